@@ -1,5 +1,7 @@
 #! /usr/bin/python
 
+from array import array
+
 # General node
 class Node:
     NONE = 0
@@ -9,6 +11,8 @@ class Node:
     def __init__(self, name=''):
         self.nodetype = Node.NONE
         self.name =  name
+        self.nodeid = -1     # integer index of the node in the graph, assigned when the graph is indexed
+        self.anchordist = None   # minimum number of edges to an anchor node for each direction of extension, if calculated
 
         self.outEdges = []   # a list of outgoing edges
 
@@ -46,6 +50,7 @@ class Edge:
     def __init__(self):
         self.startNode = None
         self.endNode = None
+        self.edgeid = None      # integer index of the edge in the graph, assigned when the graph is indexed
 
 # Edge representing an overlap in HERA scaffolder graph
 # It contains all the columns of a PAF line plus some extra calculated information
@@ -169,5 +174,114 @@ class OvlEdge(Edge):
         newEdge.OS      = self.OS
         newEdge.ESleft  = self.ESright
         newEdge.ESright = self.ESleft
+        # Reversed edge is identified by the complement of the original ID
+        if self.edgeid is not None:
+            newEdge.edgeid = ~self.edgeid
 
     	return newEdge
+
+
+# Table of edges indexed by their IDs, used to store paths as arrays of edge IDs (see EdgePath)
+# Negative IDs (complements of the original IDs) represent reversed edges, which are created when first needed
+class EdgeTable:
+    def __init__(self, edges):
+        self.edges = edges
+        self.reversedEdges = {}
+
+    def edge(self, edgeid):
+        if edgeid >= 0:
+            return self.edges[edgeid]
+        edge = self.reversedEdges.get(edgeid)
+        if edge is None:
+            edge = self.edges[~edgeid].reversed()
+            self.reversedEdges[edgeid] = edge
+        return edge
+
+    # Creates a path from a sequence of edge IDs
+    def path(self, edgeids):
+        return EdgePath(self, array('i', edgeids))
+
+
+# Path through the graph, stored as an array of edge IDs from an EdgeTable
+# Edges are looked up in the table when accessed
+# Slicing and reversing a path return views (start, stop, isreversed) sharing the same array,
+# a reversed path has the order of its edges reversed and also each edge reversed
+# count is the number of times the path has been generated, if duplicate paths are stored only once
+# Paths found by traversals also carry their summary (info) and the results of checking that the path
+# is consistent and contains no duplicate nodes, these are None if not known (e.g. for views)
+class EdgePath:
+    def __init__(self, table, ids, start = 0, stop = None, isreversed = False, count = 1):
+        self.table = table
+        self.ids = ids
+        self.start = start
+        self.stop = len(ids) if stop is None else stop
+        self.isreversed = isreversed
+        self.count = count
+        self.info = None
+        self.consistent = None
+        self.valid = None
+
+    def __len__(self):
+        return self.stop - self.start
+
+    # ID of the i-th edge of the path
+    def edgeid(self, i):
+        if self.isreversed:
+            return ~self.ids[self.stop - 1 - i]
+        return self.ids[self.start + i]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError('EdgePath supports only contiguous slices')
+            stop = max(start, stop)
+            if self.isreversed:
+                return EdgePath(self.table, self.ids, self.stop - stop, self.stop - start, True)
+            return EdgePath(self.table, self.ids, self.start + start, self.start + stop, False)
+
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError('EdgePath index out of range')
+        return self.table.edge(self.edgeid(index))
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self.table.edge(self.edgeid(i))
+
+    # Concatenation creates a new path with its own array of edge IDs
+    def __add__(self, other):
+        return EdgePath(self.table, self.edgeids() + other.edgeids())
+
+    # Reversed path represents the same generated paths, so it has the same count
+    def reversed(self):
+        return EdgePath(self.table, self.ids, self.start, self.stop, not self.isreversed, self.count)
+
+    # Returns an array of edge IDs of the path
+    def edgeids(self):
+        if self.isreversed:
+            return array('i', [~self.ids[i] for i in xrange(self.stop - 1, self.start - 1, -1)])
+        return self.ids[self.start:self.stop]
+
+
+# Set of visited nodes, stored as an array indexed by node IDs (see Node.nodeid)
+# A node is in the set if its mark equals the current epoch, so clearing the set
+# only starts a new epoch instead of resetting the whole array
+# Time critical code can read marks and epoch directly, as long as the set is not cleared meanwhile
+class VisitedSet:
+    def __init__(self, numnodes):
+        self.marks = array('l', [0]) * numnodes
+        self.epoch = 1
+
+    def add(self, node):
+        self.marks[node.nodeid] = self.epoch
+
+    def discard(self, node):
+        self.marks[node.nodeid] = 0
+
+    def __contains__(self, node):
+        return self.marks[node.nodeid] == self.epoch
+
+    def clear(self):
+        self.epoch += 1
@@ -0,0 +1,70 @@
+#! /usr/bin/python
+
+# Generates FASTA sequences of scaffolds from their layout, written by pyhera.py with --layout-only,
+# using the sequences of contigs and reads that were scaffolded
+
+import sys
+
+import paramsparser
+from pyhera import load_anchornodes, load_readnodes, load_layout, render_fasta
+
+# Parameter definitions for paramparser
+paramdefs = {'-o' : 1,
+             '--output' : 1,
+             '-t' : 1,
+             '--threads' : 1}
+
+
+def layout_to_fasta(layout_file, contigs_file, reads_file, paramdict):
+    out_filename = 'scaffolds.fasta'
+    if '-o' in paramdict:
+        out_filename = paramdict['-o'][0]
+    elif '--output' in paramdict:
+        out_filename = paramdict['--output'][0]
+    numthreads = 1
+    if '-t' in paramdict:
+        numthreads = int(paramdict['-t'][0])
+    elif '--threads' in paramdict:
+        numthreads = int(paramdict['--threads'][0])
+
+    # Contigs and reads are used as components of scaffolds
+    nodes = load_readnodes(reads_file, output=False)
+    nodes.update(load_anchornodes(contigs_file, output=False))
+
+    layout = load_layout(layout_file, nodes)
+    if layout is None:
+        sys.stderr.write('\nERROR: unable to load layout from %s!\n' % layout_file)
+        return False
+    (headers, segments_list) = layout
+
+    render_fasta(headers, segments_list, filename = out_filename, numthreads = numthreads)
+    sys.stdout.write('\nFASTA sequences generated: %d\n' % len(headers))
+
+    return True
+
+
+def verbose_usage_and_exit():
+    sys.stderr.write('layout2fasta - generates FASTA sequences of scaffolds from their layout (AGP).\n')
+    sys.stderr.write('\n')
+    sys.stderr.write('Usage:\n')
+    sys.stderr.write('\t%s <layout AGP> <contigs FASTA> <reads FASTA/FASTQ> options\n' % sys.argv[0])
+    sys.stderr.write('options:\n')
+    sys.stderr.write('-o (--output) <file> : output FASTA file (default: scaffolds.fasta)\n')
+    sys.stderr.write('-t (--threads) <number> : number of processes used to build sequences\n')
+    sys.stderr.write('\n')
+    exit(1)
+
+
+if __name__ == '__main__':
+    if (len(sys.argv) < 4):
+        verbose_usage_and_exit()
+
+    layout_file = sys.argv[1]
+    contigs_file = sys.argv[2]
+    reads_file = sys.argv[3]
+
+    pparser = paramsparser.Parser(paramdefs)
+    paramdict = pparser.parseCmdArgs(sys.argv[4:])
+
+    if not layout_to_fasta(layout_file, contigs_file, reads_file, paramdict):
+        exit(1)
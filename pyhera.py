@@ -6,6 +6,10 @@ import PAFutils
 import math
 import random
 import time
+import heapq
+import bisect
+from array import array
+from collections import deque
 from datetime import datetime
 
 # To enable importing from samscripts submodule
@@ -30,16 +34,55 @@ MinMCPaths = 40 # Minimum number of paths generated by Monte Carlo method
 HardNodeLimit = 1000    # Maximmum allowed number of nodes in a path, paths with a larger number of nodes will not be generated
 SoftNodeLimit = 100     # A number of nodes in a path after which a warning will be printed
 
+TRFuzz = 200            # Tolerance (in bases) used when testing if an edge is transitive (transitive reduction)
+
+MaxOvlPerRead = 0       # Maximum number of read/read overlaps kept for each read and direction of extension
+                        # Overlaps with the greatest overlap score are kept, 0 means keeping all overlaps
+
+MaxMCIterations = 10000     # Maximum number of iterations of the Monte Carlo method
+MCBlockIterations = 250     # Number of Monte Carlo iterations in a block, when using a seeded random number generator
+                            # Each block is seeded separately, so that results do not depend on the number of processes
+
+# Adaptive stopping of the Monte Carlo method
+# Every MCCheckInterval iterations it is checked whether the best path group for each anchor node (and its length bucket)
+# leads the second best by more than MCConvergenceZ standard deviations
+# Sampling stops when this holds for MCStableChecks consecutive checks
+MCCheckInterval = 100
+MCConvergenceZ = 2.0
+MCStableChecks = 3
+
+ReachabilityPruning = False     # Skip edges to reads that cannot reach an anchor node within HardNodeLimit
+                                # (see label_anchor_reachability())
+DeadEndMemo = False             # Remember reads from which the search has failed (see getPath_from_edge())
+
+# Beam search, used instead of depth first search by the first two approaches if BeamSearch is set
+BeamSearch = False
+BeamWidth = 20                  # Maximum number of paths kept in each step of the search
+BeamMaxExpansions = 100000      # Maximum number of paths extended, for all searches from an anchor node
+BeamTimeBudget = 60.0           # Maximum time (in seconds) for all searches from an anchor node
+
+FusedPaths = False              # Run the first two approaches together (see getPaths_fused())
+
+DedupPaths = False              # Store each distinct path only once, with the number of times it was generated (see DistinctPaths)
+
 # Direction of extending a contig with reads
 directionLEFT = 1
 directionRIGHT = 0
 
+# Ranking of edges used by deterministic approaches
+approachMAXOVL = 1      # Extending with reads with the highest overlap score
+approachMAXEXT = 2      # Extending with reads with the highest extension score
+approachMC = 3          # Extending with randomly selected reads, with probability proportional to extension score
+
 compbase = {'A' : 'T',
             'T' : 'A',
             'C' : 'G',
             'G' : 'C',
             'N' : 'N'}
 
+# Translation table for complementing a sequence (see revcomp()), characters other than bases are replaced by N
+comptable = ''.join(compbase.get(chr(i).upper(), 'N') for i in xrange(256))
+
 # Parameter definitions for paramparser
 paramdefs = {'--version' : 0,
              '-v' : 0,
@@ -52,13 +95,34 @@ paramdefs = {'--version' : 0,
              '--SImin' : 1,
              '--OHmax' : 1,
              '--MinMCPaths' : 1,
-             '--MaxNodesInPath' : 1}
+             '--MaxNodesInPath' : 1,
+             '--MaxOvlPerRead' : 1,
+             '--transitive-reduction' : 0,
+             '--TRFuzz' : 1,
+             '--split-components' : 0,
+             '--parallel-paths' : 0,
+             '--seed' : 1,
+             '--adaptive-mc' : 0,
+             '--MaxMCIterations' : 1,
+             '--MCConvergenceZ' : 1,
+             '--best-paths' : 0,
+             '--reachability-pruning' : 0,
+             '--deadend-memo' : 0,
+             '--beam-search' : 0,
+             '--BeamWidth' : 1,
+             '--BeamMaxExpansions' : 1,
+             '--BeamTimeBudget' : 1,
+             '--fused-paths' : 0,
+             '--stream-paths' : 0,
+             '--dedup-paths' : 0,
+             '--layout-only' : 0}
 
 
 # A function that loads global parameters from paramdict dictionary
 def load_global_parameters(paramdict):
 
-    global SImin, OHmax, MinMCPaths, HardNodeLimit
+    global SImin, OHmax, MinMCPaths, HardNodeLimit, MaxOvlPerRead, TRFuzz, MaxMCIterations, MCConvergenceZ
+    global ReachabilityPruning, DeadEndMemo, BeamSearch, BeamWidth, BeamMaxExpansions, BeamTimeBudget, FusedPaths, DedupPaths
 
     if '--SImin' in paramdict:
         SImin = float(paramdict['--SImin'][0])
@@ -68,6 +132,58 @@ def load_global_parameters(paramdict):
         MinMCPaths = int(paramdict['--MinMCPaths'][0])
     if '--MaxNodesInPath' in paramdict:
         HardNodeLimit = int(paramdict['--MaxNodesInPath'][0])
+    if '--MaxOvlPerRead' in paramdict:
+        MaxOvlPerRead = int(paramdict['--MaxOvlPerRead'][0])
+    if '--TRFuzz' in paramdict:
+        TRFuzz = int(paramdict['--TRFuzz'][0])
+    if '--MaxMCIterations' in paramdict:
+        MaxMCIterations = int(paramdict['--MaxMCIterations'][0])
+    if '--MCConvergenceZ' in paramdict:
+        MCConvergenceZ = float(paramdict['--MCConvergenceZ'][0])
+    ReachabilityPruning = '--reachability-pruning' in paramdict
+    DeadEndMemo = '--deadend-memo' in paramdict
+    BeamSearch = '--beam-search' in paramdict
+    FusedPaths = '--fused-paths' in paramdict
+    DedupPaths = '--dedup-paths' in paramdict
+    if '--BeamWidth' in paramdict:
+        BeamWidth = int(paramdict['--BeamWidth'][0])
+    if '--BeamMaxExpansions' in paramdict:
+        BeamMaxExpansions = int(paramdict['--BeamMaxExpansions'][0])
+    if '--BeamTimeBudget' in paramdict:
+        BeamTimeBudget = float(paramdict['--BeamTimeBudget'][0])
+
+
+# Overhangs and average overlap length of an overlap (PAF line), calculated from coordinates only
+# Returns a tuple (QOH1, QOH2, TOH1, TOH2, avg_ovl_len)
+def overlap_overhangs(pafline):
+    QOH1 = pafline['QSTART']                        # Query left overhang
+    QOH2 = pafline['QLEN'] - pafline['QEND']        # Query right overhang
+    TOH1 = pafline['TSTART']                        # Target left overhang
+    TOH2 = pafline['TLEN'] - pafline['TEND']        # Target right overhang
+
+    QOL = pafline['QEND'] - pafline['QSTART'] + 1   # Query overlap length
+    TOL = pafline['TEND'] - pafline['TSTART'] + 1   # Target overlap length
+    avg_ovl_len = (QOL + TOL)/2
+
+    return (QOH1, QOH2, TOH1, TOH2, avg_ovl_len)
+
+
+# Tests if the aligned part of an overlap is too short compared to its overhangs
+def is_short_overlap(QOH1, QOH2, TOH1, TOH2, avg_ovl_len):
+    minOH1 = QOH1 if QOH1 < TOH1 else TOH1          # Smaller left overhang
+    minOH2 = QOH2 if QOH2 < TOH2 else TOH2          # Smaller right overhang
+
+    return float(minOH1 + minOH2)/avg_ovl_len > OHmax
+
+
+# Returns the name of the read from an overlap (PAF line) that is contained within the other one,
+# or None if neither read is contained
+def contained_read(pafline, QOH1, QOH2, TOH1, TOH2):
+    if QOH1 >= TOH1 and QOH2 >= TOH2:               # Target is contained within the query
+        return pafline['TNAME']
+    if TOH1 >= QOH1 and TOH2 >= QOH2:               # Query is contained within the target
+        return pafline['QNAME']
+    return None
 
 
 # Function that test if an overlap (PAF line) is usable or not
@@ -89,18 +205,11 @@ def test_overlap(pafline, reads_to_discard, test_contained_reads = True, test_sh
     #     pafline['TSTART'] = new_tstart
     #     pafline['TEND'] = new_tend
 
-    QOH1 = pafline['QSTART']                        # Query left overhang
-    QOH2 = pafline['QLEN'] - pafline['QEND']        # Query right overhang
-    TOH1 = pafline['TSTART']                        # Target left overhang
-    TOH2 = pafline['TLEN'] - pafline['TEND']        # Target right overhang
-
-    QOL = pafline['QEND'] - pafline['QSTART'] + 1   # Query overlap length
-    TOL = pafline['TEND'] - pafline['TSTART'] + 1   # Target overlap length
+    (QOH1, QOH2, TOH1, TOH2, avg_ovl_len) = overlap_overhangs(pafline)
 
     SI = float(pafline['NRM']) / pafline['ABL']     # Sequence identity
                                                     # TODO: check if this is correctly calculated
                                                     # PAF fil might not give us completely correct information
-    avg_ovl_len = (QOL + TOL)/2
     OS = avg_ovl_len * SI                           # Overlap score
     QES1 = OS + TOH1/2 - (QOH1 + TOH2)/2            # Extension score for extending Query with Target to the left
     QES2 = OS + TOH2/2 - (QOH2 + TOH1)/2            # Extension score for extending Query with Target to the right
@@ -122,9 +231,6 @@ def test_overlap(pafline, reads_to_discard, test_contained_reads = True, test_sh
     minQOH = QOH1 if QOH1 < QOH2 else QOH2          # Smaller query overhang, will be used to determine if the overlap is discarded
     minTOH = TOH1 if TOH1 < TOH2 else TOH2          # Smaller target overhang, will be used to determine if the overlap is discarded
 
-    minOH1 = QOH1 if QOH1 < TOH1 else TOH1          # Smaller left overhang
-    minOH2 = QOH2 if QOH2 < TOH2 else TOH2          # Smaller right overhang
-
     # Test for too short aligned length
     # In this case the overlap is discarded, but both reads are kept
     # if test_short_length:
@@ -133,24 +239,17 @@ def test_overlap(pafline, reads_to_discard, test_contained_reads = True, test_sh
 
     # New test for short overlaps
     if test_short_length:
-        if  float(minOH1 + minOH2)/avg_ovl_len > OHmax:
+        if is_short_overlap(QOH1, QOH2, TOH1, TOH2, avg_ovl_len):
             return -2
 
     # Test for contained reads
     # Has to come after test for short aligned length, if the overlap is of too short a length
     # Its probably a false overlap
     if test_contained_reads:
-        if QOH1 >= TOH1 and QOH2 >= TOH2:
-            # Target is contained within the query
-            # Discarding the overlap and target read
-            tname = pafline['TNAME']
-            reads_to_discard[tname] = 1
-            return -1
-        if TOH1 >= QOH1 and TOH2 >= QOH2:
-            # Query is contained within the target
-            # Discarding the overlap and query read
-            qname = pafline['QNAME']
-            reads_to_discard[qname] = 1
+        cname = contained_read(pafline, QOH1, QOH2, TOH1, TOH2)
+        if cname is not None:
+            # Discarding the overlap and contained read
+            reads_to_discard[cname] = 1
             return -1
 
     # Test for low quality overlap
@@ -172,9 +271,47 @@ def test_overlap(pafline, reads_to_discard, test_contained_reads = True, test_sh
 
     return 1
 
+# Returns the direction in which an edge extends its start node (LEFT or RIGHT)
+def edge_direction(edge):
+    if edge.ESright > edge.ESleft:
+        return directionRIGHT
+    return directionLEFT
+
+
+# Returns the number of bases by which the end node of an edge extends its start node
+# in a given direction
+def edge_extension(edge, direction):
+    if direction == directionRIGHT:
+        return edge.SStart - edge.EStart
+    else:
+        return (edge.SLen - edge.SEnd) - (edge.ELen - edge.EEnd)
+
+
+# A lightweight pass over overlaps (PAF lines) that finds contained reads before any edges are created
+# Looks only at overlap coordinates, applying the same tests for short overlaps and contained reads
+# as test_overlap()
+# Contained reads are marked in reads_to_discard dictionary
+def find_contained_reads(paf_lines, reads_to_discard):
+
+    for pafline in paf_lines:
+        (QOH1, QOH2, TOH1, TOH2, avg_ovl_len) = overlap_overhangs(pafline)
+
+        # Overlaps that are too short are discarded before testing for containment
+        if is_short_overlap(QOH1, QOH2, TOH1, TOH2, avg_ovl_len):
+            continue
+
+        cname = contained_read(pafline, QOH1, QOH2, TOH1, TOH2)
+        if cname is not None:
+            reads_to_discard[cname] = 1
+
+
 # Check paths for consistency, to see if consecutive edges are realy connected by a node
+# Paths found by traversals are known to be consistent (see finish_path())
 def check_path_consistency(path):
 
+    if isinstance(path, EdgePath) and path.consistent is not None:
+        return path.consistent
+
     # Empty path is consistent
     if len(path) == 0:
         return True
@@ -191,7 +328,11 @@ def check_path_consistency(path):
 
 
 # Checking paths, to see if any contain duplicate reads!
+# Paths found by traversals are known to be valid (see finish_path())
 def check_path(path):
+    if isinstance(path, EdgePath) and path.valid:
+        return True
+
     used_nodes = {}
     if len(path) == 0:
         sys.stderr.write('\nERROR: empty path!')
@@ -249,6 +390,9 @@ def load_cr_overlaps(cr_overlaps_file, anchornodes, readnodes, reads_to_discard,
 
     cr_paf_lines = load_paf(cr_overlaps_file, output)
 
+    # Determining contained reads up front, so that no edges are created for them
+    find_contained_reads(cr_paf_lines, reads_to_discard)
+
     ncontained = nshort = nlowqual = nusable = nzeroes = 0
     for pafline in cr_paf_lines:
         qcontig = True              # Is PAF query a contig? If false, PAF target is contig
@@ -271,6 +415,11 @@ def load_cr_overlaps(cr_overlaps_file, anchornodes, readnodes, reads_to_discard,
         else:
             sys.stderr.write('\nERROR CROVL: TNAME from PAF (%s) doesn\'t exist in reads or contigs!' % tname)
 
+        # Skipping overlaps for contained reads
+        if rnode is not None and rnode.name in reads_to_discard:
+            ncontained += 1
+            continue
+
         # retval = test_overlap(pafline, reads_to_discard, test_contained_reads = False)
         retval = test_overlap(pafline, reads_to_discard)
         if retval == 1:
@@ -325,6 +474,38 @@ def load_cr_overlaps(cr_overlaps_file, anchornodes, readnodes, reads_to_discard,
     return crovledges, isolated_anodes
 
 
+# Places an edge into a bounded heap kept for its start node and direction of extension
+# Each heap keeps at most maxedges edges with the greatest overlap score, when the heap is full
+# the worst edge is dropped (for equal scores the edge that came later is dropped)
+# seqno is the order in which the edge was created and is used to restore that order later
+# Returns the number of dropped edges (0 or 1)
+def push_bounded_edge(edge_heaps, edge, seqno, maxedges):
+    direction = edge_direction(edge)
+
+    key = (edge.SName, direction)
+    if key not in edge_heaps:
+        edge_heaps[key] = []
+    heap = edge_heaps[key]
+
+    item = (edge.OS, -seqno, edge)
+    if len(heap) < maxedges:
+        heapq.heappush(heap, item)
+        return 0
+    else:
+        heapq.heappushpop(heap, item)
+        return 1
+
+
+# Collects edges kept in bounded heaps, in the order in which they were created
+def collect_bounded_edges(edge_heaps):
+    items = []
+    for heap in edge_heaps.itervalues():
+        items += heap
+    items.sort(key=lambda item: item[1], reverse=True)
+
+    return [item[2] for item in items]
+
+
 # Load read/read overlaps in a signle thread
 def load_rr_overlaps_ST(rr_overlaps_file, readnodes, reads_to_discard, output=True):
     rrovledges = []             # Edges representing overlaps between reads and reads
@@ -333,7 +514,10 @@ def load_rr_overlaps_ST(rr_overlaps_file, readnodes, reads_to_discard, output=Tr
     dummy_reads_to_discard = {}         # When checking overlaps between reads, only discarding overlaps
                                         # and not the actual reads
 
-    ncontained = nshort = nlowqual = nusable = 0
+    edge_heaps = {}                     # Used only if the number of overlaps per read is bounded
+    seqno = 0
+
+    ncontained = nshort = nlowqual = nusable = ndropped = ndiscarded = 0
     for pafline in rr_paf_lines:
         rnode1 = rnode2 = None
         qname = pafline['QNAME']
@@ -353,6 +537,11 @@ def load_rr_overlaps_ST(rr_overlaps_file, readnodes, reads_to_discard, output=Tr
         if qname == tname:
             continue
 
+        # Discard overlaps with reads that will be removed from the graph
+        if qname in reads_to_discard or tname in reads_to_discard:
+            ndiscarded += 1
+            continue
+
         # retval = test_overlap(pafline, reads_to_discard, test_contained_reads=False, test_short_length=False)
         retval = test_overlap(pafline, dummy_reads_to_discard)
         if retval == 1:
@@ -361,12 +550,17 @@ def load_rr_overlaps_ST(rr_overlaps_file, readnodes, reads_to_discard, output=Tr
             edge2 = OvlEdge(pafline, reverse=True)
             edge1.startNode = rnode1
             edge1.endNode = rnode2
-            rnode1.outEdges.append(edge1)
             edge2.startNode = rnode2
             edge2.endNode = rnode1
-            rnode2.outEdges.append(edge2)
-            rrovledges.append(edge1)
-            rrovledges.append(edge2)
+            if MaxOvlPerRead > 0:
+                ndropped += push_bounded_edge(edge_heaps, edge1, seqno, MaxOvlPerRead)
+                ndropped += push_bounded_edge(edge_heaps, edge2, seqno + 1, MaxOvlPerRead)
+                seqno += 2
+            else:
+                rnode1.outEdges.append(edge1)
+                rnode2.outEdges.append(edge2)
+                rrovledges.append(edge1)
+                rrovledges.append(edge2)
         elif retval == -1:
             ncontained += 1
         elif retval == -2:
@@ -376,6 +570,12 @@ def load_rr_overlaps_ST(rr_overlaps_file, readnodes, reads_to_discard, output=Tr
         else:
             sys.stderr.write('\nERROR: unknown return value by test_overlap()!')
 
+    # Only the best overlaps were kept, connecting them to the graph
+    if MaxOvlPerRead > 0:
+        for edge in collect_bounded_edges(edge_heaps):
+            edge.startNode.outEdges.append(edge)
+            rrovledges.append(edge)
+
     if output == True:
         sys.stdout.write('\nProcessing overlaps between reads and reads!')
         sys.stdout.write('\nNumber of overlaps: %d' % len(rr_paf_lines))
@@ -383,21 +583,27 @@ def load_rr_overlaps_ST(rr_overlaps_file, readnodes, reads_to_discard, output=Tr
         sys.stdout.write('\nContained: %d' % ncontained)
         sys.stdout.write('\nShort: %d' % nshort)
         sys.stdout.write('\nLow quality: %d' % nlowqual)
+        sys.stdout.write('\nDiscarded (contained reads): %d' % ndiscarded)
+        if MaxOvlPerRead > 0:
+            sys.stdout.write('\nDropped (more than %d per read and direction): %d' % (MaxOvlPerRead, ndropped))
         sys.stdout.write('\n')
 
     return rrovledges
 
-def load_rr_overlaps_part(proc_id, rr_paf_lines_part, readnodes, out_q):
+def load_rr_overlaps_part(proc_id, rr_paf_lines_part, readnodes, reads_to_discard, out_q):
 
     sys.stdout.write('\nPYHERA: Starting process %d...\n' % proc_id)
 
     rrovledges_part = []
     readnodes_part = {}             # A dictionary to collect partial graph
                                     # created by this function
-    ncontained = nshort = nlowqual = nusable = 0
+    ncontained = nshort = nlowqual = nusable = ndropped = ndiscarded = 0
 
     dummy_reads_to_discard = {}     # Currently not used, but a placeholder for maybe using it later
 
+    edge_heaps = {}                 # Used only if the number of overlaps per read is bounded
+    seqno = 0
+
     for pafline in rr_paf_lines_part:
         rnode1 = rnode2 = None
         qname = pafline['QNAME']
@@ -417,6 +623,11 @@ def load_rr_overlaps_part(proc_id, rr_paf_lines_part, readnodes, out_q):
         if qname == tname:
             continue
 
+        # Discard overlaps with reads that will be removed from the graph
+        if qname in reads_to_discard or tname in reads_to_discard:
+            ndiscarded += 1
+            continue
+
         # retval = test_overlap(pafline, reads_to_discard, test_contained_reads=False, test_short_length=False)
         retval = test_overlap(pafline, dummy_reads_to_discard)
         if retval == 1:
@@ -425,6 +636,14 @@ def load_rr_overlaps_part(proc_id, rr_paf_lines_part, readnodes, out_q):
             edge2 = OvlEdge(pafline, reverse=True)
             edge1.startNode = rnode1
             edge1.endNode = rnode2
+            edge2.startNode = rnode2
+            edge2.endNode = rnode1
+            if MaxOvlPerRead > 0:
+                ndropped += push_bounded_edge(edge_heaps, edge1, seqno, MaxOvlPerRead)
+                ndropped += push_bounded_edge(edge_heaps, edge2, seqno + 1, MaxOvlPerRead)
+                seqno += 2
+                continue
+
             # rnode1.outEdges.append(edge1)
             t_edges = []
             if qname in readnodes_part:
@@ -432,8 +651,6 @@ def load_rr_overlaps_part(proc_id, rr_paf_lines_part, readnodes, out_q):
             t_edges.append(edge1)
             readnodes_part[qname] = t_edges
 
-            edge2.startNode = rnode2
-            edge2.endNode = rnode1
             # rnode2.outEdges.append(edge2)
             t_edges = []
             if tname in readnodes_part:
@@ -452,7 +669,15 @@ def load_rr_overlaps_part(proc_id, rr_paf_lines_part, readnodes, out_q):
         else:
             sys.stderr.write('\nERROR: unknown return value by test_overlap()!')
 
-    out_q.put((rrovledges_part, readnodes_part, ncontained, nshort, nlowqual, nusable))
+    # Only the best overlaps were kept, the final selection is made after all parts are collected
+    if MaxOvlPerRead > 0:
+        for edge in collect_bounded_edges(edge_heaps):
+            if edge.SName not in readnodes_part:
+                readnodes_part[edge.SName] = []
+            readnodes_part[edge.SName].append(edge)
+            rrovledges_part.append(edge)
+
+    out_q.put((proc_id, rrovledges_part, readnodes_part, ncontained, nshort, nlowqual, nusable, ndropped, ndiscarded))
     sys.stdout.write('\nEnding process %d...\n' % proc_id)
     pass
 
@@ -476,19 +701,26 @@ def load_rr_overlaps_MT(rr_overlaps_file, readnodes, reads_to_discard, numthread
     for rr_paf_lines_part in rr_paf_lines_split:
         proc_id += 1
         partname = 'THREAD%d' % proc_id
-        proc = multiprocessing.Process(name=partname, target=load_rr_overlaps_part, args=(proc_id, rr_paf_lines_part, readnodes, out_q,))
+        proc = multiprocessing.Process(name=partname, target=load_rr_overlaps_part, args=(proc_id, rr_paf_lines_part, readnodes, reads_to_discard, out_q,))
         jobs.append(proc)
         proc.start()
 
     # Summarizing results from different processes
-    ncontained = nshort = nlowqual = nusable = 0
+    ncontained = nshort = nlowqual = nusable = ndropped = ndiscarded = 0
+    results = []
     for i in xrange(len(jobs)):
-        (rrovledges_part, readnodes_part, t_ncontained, t_nshort, t_nlowqual, t_nusable) = out_q.get()
-        rrovledges += rrovledges_part
+        results.append(out_q.get())
+    results.sort(key=lambda result: result[0])      # Processing parts in the order of the input file
+
+    rrovledges_parts = []
+    for (proc_id, rrovledges_part, readnodes_part, t_ncontained, t_nshort, t_nlowqual, t_nusable, t_ndropped, t_ndiscarded) in results:
+        rrovledges_parts.append(rrovledges_part)
         ncontained += t_ncontained
         nshort += t_nshort
         nlowqual += t_nlowqual
         nusable += t_nusable
+        ndropped += t_ndropped
+        ndiscarded += t_ndiscarded
         readnodes_parts.append(readnodes_part)
     
     if output:
@@ -498,11 +730,33 @@ def load_rr_overlaps_MT(rr_overlaps_file, readnodes, reads_to_discard, numthread
     for proc in jobs:
         proc.join()
 
-    # Summarizing edges for each node
-    for readnodes_part in readnodes_parts:
-        for rname, t_outedges in readnodes_part.iteritems():
-            rnode = readnodes[rname]
-            rnode.outEdges += t_outedges
+    # Edges returned from the processes point to copies of read nodes,
+    # connecting them back to the nodes in the graph
+    for rrovledges_part in rrovledges_parts:
+        for edge in rrovledges_part:
+            edge.startNode = readnodes[edge.SName]
+            edge.endNode = readnodes[edge.EName]
+
+    if MaxOvlPerRead > 0:
+        # Each part kept its best overlaps, selecting the best ones among all parts
+        edge_heaps = {}
+        seqno = 0
+        for rrovledges_part in rrovledges_parts:
+            for edge in rrovledges_part:
+                ndropped += push_bounded_edge(edge_heaps, edge, seqno, MaxOvlPerRead)
+                seqno += 1
+        for edge in collect_bounded_edges(edge_heaps):
+            edge.startNode.outEdges.append(edge)
+            rrovledges.append(edge)
+    else:
+        for rrovledges_part in rrovledges_parts:
+            rrovledges += rrovledges_part
+
+        # Summarizing edges for each node
+        for readnodes_part in readnodes_parts:
+            for rname, t_outedges in readnodes_part.iteritems():
+                rnode = readnodes[rname]
+                rnode.outEdges += t_outedges
 
 
     # KK: Old, single process, code is commented here
@@ -552,386 +806,1057 @@ def load_rr_overlaps_MT(rr_overlaps_file, readnodes, reads_to_discard, numthread
         sys.stdout.write('\nContained: %d' % ncontained)
         sys.stdout.write('\nShort: %d' % nshort)
         sys.stdout.write('\nLow quality: %d' % nlowqual)
+        sys.stdout.write('\nDiscarded (contained reads): %d' % ndiscarded)
+        if MaxOvlPerRead > 0:
+            sys.stdout.write('\nDropped (more than %d per read and direction): %d' % (MaxOvlPerRead, ndropped))
         sys.stdout.write('\n')
 
     return rrovledges
     
+# Labels every read node with the minimum number of edges needed to reach an anchor node,
+# separately for each direction of extension (node.anchordist[direction], None if no anchor node can be reached)
+# Uses breadth first search from all anchor nodes at once, over reversed edges
+# Edges are only required to extend in the given direction, and reads can be repeated, so the labels
+# are lower bounds for all approaches
+def label_anchor_reachability(anchornodes, readnodes):
+    predecessors = ({}, {})             # For each direction, read nodes with an edge to a given node
+    for rnode in readnodes.itervalues():
+        rnode.anchordist = [None, None]
+        for edge in rnode.outEdges:
+            predecessors[edge_direction(edge)].setdefault(edge.endNode.name, []).append(rnode)
+
+    for direction in (directionRIGHT, directionLEFT):
+        dist = 0
+        frontier = anchornodes.keys()
+        while frontier:
+            dist += 1
+            next_frontier = []
+            for name in frontier:
+                for rnode in predecessors[direction].get(name, []):
+                    if rnode.anchordist[direction] is None:
+                        rnode.anchordist[direction] = dist
+                        next_frontier.append(rnode.name)
+            frontier = next_frontier
+
+
+# Checks if a path with numedges edges, extended by an edge to read node rnode, can still reach
+# an anchor node without exceeding HardNodeLimit (see label_anchor_reachability())
+def can_reach_anchor(rnode, direction, numedges):
+    dist = rnode.anchordist[direction]
+    return dist is not None and numedges + dist - 1 < HardNodeLimit
+
+
+# Flags describing why a failed search from a read node might depend on the context of the search
+# (see getPath_from_edge())
+taintTRAVERSED = 1      # An edge was skipped because its read had already been traversed
+taintDEPTH = 2          # An edge was skipped because of HardNodeLimit
+taintSTART = 4          # An edge to the starting anchor node was skipped
+taintAPPROACH = 8       # Edges were chosen in a way specific to the approach (only the top N reads were considered,
+                        # or an edge to an anchor with no positive extension score was skipped)
+
+# Records in memo that the search from read node rnode in a given direction has failed to reach an anchor node
+# Failures that depend on traversed reads or path length are not recorded, other failures are recorded
+# with the starting anchor node and the approach for which they are valid (None meaning valid for all)
+def record_deadend(memo, rnode, direction, taint, aname, approach):
+    if taint & (taintTRAVERSED | taintDEPTH):
+        return
+    memo[(rnode.name, direction)] = (aname if taint & taintSTART else None, approach if taint & taintAPPROACH else None)
+
+
+# Checks if memo contains a failed search from read node rnode in a given direction which is valid
+# for starting anchor node aname and approach (None for Monte Carlo)
+# Returns the taint flags that the failure passes on to a search that skips the read (taintSTART,
+# taintAPPROACH), or None if there is no usable record
+def lookup_deadend(memo, rnode, direction, aname, approach):
+    entry = memo.get((rnode.name, direction))
+    if entry is None:
+        return None
+    (start, entry_approach) = entry
+    if start is not None and start != aname:
+        return None
+    if entry_approach is not None and entry_approach != approach:
+        return None
+    return (taintSTART if start is not None else 0) | (taintAPPROACH if entry_approach is not None else 0)
+
+
+# Adds an edge extending a path in a given direction to the prefix sums of extensions (lengths)
+# and SIs (SIsums) of its edges, maintained by traversals while the path is built
+# Extensions that are not positive are invalid (see calc_path_info()), and are recorded as None
+def push_path_metrics(lengths, SIsums, edge, direction):
+    extension = edge_extension(edge, direction)
+    lengths.append(lengths[-1] + extension if extension > 0 and lengths[-1] is not None else None)
+    SIsums.append(SIsums[-1] + edge.SI)
+
+
+# Creates an EdgePath from a path found by a traversal, with the summary of the path (see calc_path_info())
+# taken from the prefix sums maintained by the traversal (see push_path_metrics())
+# Traversals extend the path only from its last node and use each read only once,
+# so the path is known to be consistent and without duplicate nodes
+def finish_path(path, direction, lengths, SIsums):
+    epath = make_path(path)
+    if lengths[-1] is not None:
+        epath.info = (lengths[-1] + path[-1].ELen, len(path) + 1, path[0].startNode.name, path[-1].endNode.name, direction, float(SIsums[-1]) / len(path))
+    epath.consistent = True
+    epath.valid = True
+    return epath
+
+
+# Finds a path starting with a given edge of anchor node aname, using depth first search
+# with backtracking, used by the first two approaches
+# approach determines how edges are ranked:
+# - approachMAXOVL: consider only the reads with the highest OVERLAP score
+# - approachMAXEXT: consider only the reads with the highest EXTENSION score
+# reads_traversed is a set of reads that have already been traversed (see new_visited_set()), each read can only be used once
+# memo is an optional dictionary of dead ends, i.e. reads from which the search has failed (see record_deadend()),
+# reads recorded in it are not searched again and new dead ends are added to it
+# For this, the taint of each read in the path is tracked, collecting the reasons why its search might
+# depend on the context (traversed reads, path length, starting anchor node or approach)
+# The summary of the path is maintained while edges are added and removed (see finish_path())
+# Returns the found path (an EdgePath), or None if no other anchor node can be reached
+def getPath_from_edge(aname, edge, reads_traversed, approach, memo=None):
+    N = 20           # Number of nodes placed on stack in each steop of graph traversal
+
+    path = []               # Initializing a path
+    lengths = [0]           # Prefix sums of extensions and SIs of edges in the path
+    SIsums = [0]
+    taints = []             # Taint of each read in the path
+    stack = []              # and a stack for graph traversal
+                            # A stack will contain a list of edges to be processed
+    marks = reads_traversed.marks       # Traversed reads are marked with the current epoch of the set
+    epoch = reads_traversed.epoch
+
+    # For each read determine the direction of extension (LEFT or RIGHT)
+    # Needs to be preserved throughout the path
+    direction = edge_direction(edge)
+
+    # KK: Control
+    if approach == approachMAXOVL and edge.ESright <= 0 and edge.ESleft <= 0:
+        return None
+    if ReachabilityPruning and edge.endNode.nodetype == Node.READ and not can_reach_anchor(edge.endNode, direction, 0):
+        return None
+    if memo is not None and edge.endNode.nodetype == Node.READ and lookup_deadend(memo, edge.endNode, direction, aname, approach) is not None:
+        return None
+
+    stack.append(edge)      # For each inital node, place only its edge on the stack
+    # In each step of graph traversal:
+    # - Pop the last node
+    # - Check if it can connect to an anchor node
+    # - If it can, the path is complete
+    # - If not, get a number of connected read nodes with the greatest OS (or ES) and place them on the stack
+    # - If no reads are available, adjust the path and continue
+    while stack:
+        redge = stack.pop()                             # Pop an edge from the stack
+        rnode = redge.endNode                           # And the corresponding node
+
+        # Check if the node from the stack can continue the current path
+        if (len(path) > 0) and (path[-1].endNode != redge.startNode):
+            # If not, put the edge back on the stack
+            stack.append(redge)
+            # And remove the last edge from the path
+            # (search from its read has failed, its taint is passed on to the previous read)
+            edge2 = path.pop()
+            del lengths[-1], SIsums[-1]
+            taint = taints.pop()
+            if memo is not None:
+                record_deadend(memo, edge2.endNode, direction, taint, aname, approach)
+                if taints:
+                    taints[-1] |= taint
+            # Skip to next iteration
+            continue
+
+        # Check if the path is too long skip this iteration and let
+        # the above code eventually reduce the path
+        if len(path) >= HardNodeLimit:
+            if taints:
+                taints[-1] |= taintDEPTH
+            continue
+
+        path.append(redge)                              # Add edge to the path
+        push_path_metrics(lengths, SIsums, redge, direction)
+        taints.append(0)
+        marks[rnode.nodeid] = epoch                     # And mark the node as traversed
+
+        # Edges are taken from the adjacency of the node, already filtered and ordered by OS (or ES) for the approach
+        (Aedges, Redges, Rzero, cumES, zero_anchor) = get_adjacency(rnode, direction)
+        taint = taintAPPROACH if zero_anchor and approach == approachMAXOVL else 0
+
+        Aedge = None                                    # If anchor nodes have been reached take the best one
+        for edge2 in Aedges[approach]:
+            if edge2.endNode.name != aname:             # We only want nodes that are different from the starting node!
+                Aedge = edge2                           # NOTE: this might change, as we migh want scaffold circulat genomes!
+                break
+            taint |= taintSTART
+
+        next_edges = []                                 # Top N edges to reads that have not been traversed
+        numRedges = 0
+        if Aedge is None:
+            for edge2 in Redges[approach]:
+                endNode = edge2.endNode
+                if marks[endNode.nodeid] == epoch:      # Each read can only be used once
+                    taint |= taintTRAVERSED
+                    continue
+                if ReachabilityPruning and not can_reach_anchor(endNode, direction, len(path)):
+                    taint |= taintDEPTH
+                    continue
+                numRedges += 1
+                if numRedges <= N:
+                    next_edges.append(edge2)
+                elif memo is None:
+                    break
+            if numRedges == 0 and approach == approachMAXEXT:
+                # Reads with no positive extension score are never placed on the stack,
+                # but if there are any, the traversal is not considered to have come to a dead end
+                for edge2 in Rzero:
+                    if marks[edge2.endNode.nodeid] != epoch and not (ReachabilityPruning and not can_reach_anchor(edge2.endNode, direction, len(path))):
+                        numRedges = 1
+                        break
+        taints[-1] |= taint
+
+        if Aedge is not None:                                       # Create a path and end this instance of tree traversal
+            path.append(Aedge)
+            push_path_metrics(lengths, SIsums, Aedge, direction)
+            return finish_path(path, direction, lengths, SIsums)
+        elif numRedges > 0:                                         # If no anchor nodes have been found we have to continue with read nodes
+            next_edges.reverse()                                    # Place N best edges on the stack in reverse order, so that the best one ends on top
+            if memo is not None:
+                if numRedges > N:
+                    taints[-1] |= taintAPPROACH
+                for redge in next_edges:                            # Reads that are known dead ends are not searched again
+                    deadend_taint = lookup_deadend(memo, redge.endNode, direction, aname, approach)
+                    if deadend_taint is None:
+                        stack.append(redge)
+                    else:
+                        taints[-1] |= deadend_taint
+            else:
+                stack += next_edges
+
+        else:                                                       # Graph traversal has come to a dead end
+            try:
+                edge2 = path.pop()                                      # Remove the last edge from the path
+                del lengths[-1], SIsums[-1]
+                marks[rnode.nodeid] = 0                                 # Remove current read node from the set of traversed ones
+            except:
+                import pdb
+                pdb.set_trace()
+                pass
+            taint = taints.pop()
+            if memo is not None:
+                record_deadend(memo, rnode, direction, taint, aname, approach)
+                if taints:
+                    taints[-1] |= taint
+
+    # The search has failed for all reads remaining in the path
+    if memo is not None:
+        while path:
+            taint = taints.pop()
+            record_deadend(memo, path.pop().endNode, direction, taint, aname, approach)
+            if taints:
+                taints[-1] |= taint
+
+    return None
+
+
 # 1st Approach
 # For every anchor node consider all connecting read nodes
 # For further extension consider only the read with the highest OVERLAP score
-def getPaths_maxovl(anchornodes, readnodes, crovledges, rrovledges, output=True):
+# memo is an optional dictionary of dead ends, shared by all start edges (see getPath_from_edge())
+def getPaths_maxovl(anchornodes, readnodes, crovledges, rrovledges, output=True, memo=None):
     paths = []      # A list of paths
                     # Each path is a list of its own, containing edges that are traversed
-    reads_traversed = {}    # A dictionary of reads that have already been traversed
-                            # Each read can only be used once
-    N = 20           # Number of nodes placed on stack in each steop of graph traversal
+    reads_traversed = new_visited_set()     # A set of reads that have already been traversed
+                                            # Each read can only be used once
 
     if output:
         sys.stdout.write('\nPYHERA: Starting collecting paths using maximum overlap score!')
-    for (aname, anode) in anchornodes.iteritems():
+    for aname in sorted(anchornodes.iterkeys()):        # Anchor nodes are processed in a fixed order
+        anode = anchornodes[aname]
         for edge in anode.outEdges:
-            path = []               # Initializing a path
-            stack = []              # and a stack for graph traversal
-                                    # A stack will contain a list of edges to be processed
+            path = getPath_from_edge(aname, edge, reads_traversed, approachMAXOVL, memo)
+            if path is not None:
+                paths.append(path)
 
-            # For each read determine the direction of extension (LEFT or RIGHT)
-            # Needs to be preserved throughout the path
-            direction = directionLEFT
-            if edge.ESright > edge.ESleft:
-                direction = directionRIGHT
+    if output:
+        sys.stdout.write('\nPYHERA: Finishing collecting paths using maximum overlap score!')
 
-            # KK: Control
-            if edge.ESright <= 0 and edge.ESleft <= 0:
-                continue
+    return paths
 
-            stack.append(edge)      # For each inital node, place only its edge on the stack
-            # In each step of graph traversal:
-            # - Pop the last node
-            # - Check if it can connect to an anchor node
-            # - If it can, the path is complete
-            # - If not, get a number of connected read nodes with the greatest OS and place them on the stack
-            # - If no reads are available, adjust the path and continue
-            while stack:
-                redge = stack.pop()                             # Pop an edge from the stack
-                rnode = redge.endNode                           # And the corresponding node
 
-                # Check if the node from the stack can continue the current path
-                if (len(path) > 0) and (path[-1].endNode != redge.startNode):
-                    # If not, put the edge back on the stack
-                    stack.append(redge)
-                    # And remove the last edge from the path
-                    path.pop()
-                    # Skip to next iteration
-                    continue
+# 2nd Approach
+# For every anchor node consider all connecting read nodes
+# For further extension consider only the read with the highest EXTENSION score
+# memo is an optional dictionary of dead ends, shared by all start edges (see getPath_from_edge())
+def getPaths_maxext(anchornodes, readnodes, crovledges, rrovledges, output=True, memo=None):
+    paths = []      # A list of paths
+                    # Each path is a list of its own, containing edges that are traversed
+    reads_traversed = new_visited_set()     # A set of reads that have already been traversed
+                                            # Each read can only be used once
 
-                # Check if the path is too long skip this iteration and let
-                # the above code eventually reduce the path
-                if len(path) >= HardNodeLimit:
-                    continue
+    if output:
+        sys.stdout.write('\nPYHERA: Starting collecting paths using maximum extension score!')
 
-                path.append(redge)                              # Add edge to the path
-                reads_traversed[rnode.name] = 1                 # And mark the node as traversed
+    for aname in sorted(anchornodes.iterkeys()):        # Anchor nodes are processed in a fixed order
+        anode = anchornodes[aname]
+        for edge in anode.outEdges:
+            path = getPath_from_edge(aname, edge, reads_traversed, approachMAXEXT, memo)
+            if path is not None:
+                paths.append(path)
 
-                Aedges = []                                     # Edges to anchor nodes
-                Redges = []                                     # Edges to read nodes
+    if output:
+        sys.stdout.write('\nPYHERA: Finishing collecting paths using maximum extension score!')
 
-                for edge2 in rnode.outEdges:
-                    # KK: Control
-                    if edge2.ESright <= 0 and edge2.ESleft <= 0:
-                        continue
+    return paths
 
-                    endNode = edge2.endNode
-                    if endNode.name in reads_traversed:         # Each read can only be used once
-                        continue
-                    direction2 = directionLEFT
-                    if edge2.ESright > edge2.ESleft:
-                        direction2 = directionRIGHT
-                    if direction2 != direction:                 # Direction of extension must be maintained
-                        continue
 
-                    if endNode.nodetype == Node.ANCHOR:
-                        if endNode.name != aname:               # We only want nodes that are different from the starting node!
-                            Aedges.append(edge2)                # NOTE: this might change, as we migh want scaffold circulat genomes!
-                    elif endNode.nodetype == Node.READ:
-                        Redges.append(edge2)
-                    else:
-                        sys.stderr.write("PYHERA: ERROR - invalid node type: %d" % endNode.nodetype)
+# Cost of extending a path with an edge, used when searching for best paths
+# Inverse of the OVERLAP score (approachMAXOVL) or the EXTENSION score in a given direction (approachMAXEXT),
+# so that paths with fewer edges with higher scores are preferred
+# Returns None if the edge cannot be used, i.e. if it does not extend in the given direction
+# with a positive extension score
+def edge_cost(edge, direction, approach):
+    if edge_direction(edge) != direction:
+        return None
+    if direction == directionRIGHT:
+        extscore = edge.ESright
+    else:
+        extscore = edge.ESleft
+    score = edge.OS if approach == approachMAXOVL else extscore
+    if extscore <= 0 or score <= 0:
+        return None
+    return 1.0 / score
+
+
+# Finds the best paths from an anchor node in a given direction to all reachable anchor nodes,
+# using Dijkstra's algorithm with edge costs calculated by edge_cost()
+# Anchor nodes end the paths, and paths are limited to HardNodeLimit edges
+# The number of edges is a part of the search state: a node is expanded again if it is reached with fewer
+# edges than before, so that nodes reached with a cheap but long path can still be reached with a shorter one
+# Since edge costs are positive, paths never visit the same node twice
+# Paths are represented as chains (see chain_to_path()), so that they can share common beginnings
+# reads_traversed is a set of reads used by paths found so far (see new_visited_set()), each read can only
+# be used once, as in the first two approaches
+# A path is accepted only if none of its reads have been used, after which its reads are added to reads_traversed
+# Returns the list of paths, ordered by cost
+def getBestPaths_from_anchor(anode, direction, approach, reads_traversed):
+    paths = []
+    reached = {anode.name : True}       # Anchor nodes to which a path has been found, and the starting one
+    minedges = {}                       # The smallest number of edges with which each read has been expanded
+    heap = []
+    seqno = 0                           # Heap entries are ordered by cost, and then by the order in which they are added
+
+    for edge in anode.outEdges:
+        cost = edge_cost(edge, direction, approach)
+        if cost is not None and not (edge.endNode.nodetype == Node.READ and edge.endNode in reads_traversed):
+            heapq.heappush(heap, (cost, seqno, (edge, None), 1))
+            seqno += 1
+
+    while heap:
+        (cost, _, chain, numedges) = heapq.heappop(heap)
+        node = chain[0].endNode
+        if node.name in reached:
+            continue
 
-                if Aedges:                                                  # If anchor nodes have been reached find the best one
-                    Aedges.sort(key=lambda edge: edge.OS, reverse=True)     # by sorting them according to OS and taking the first one
-                    Aedge = Aedges[0]                                       # Create a path and end this instance of tree traversal
-                    path.append(Aedge)
-                    paths.append(path)
+        if node.nodetype == Node.ANCHOR:            # Anchor nodes end the paths
+            path = chain_to_path(chain)
+            # Reads can be used by a path found after this one has been placed on the heap
+            for edge2 in path[:-1]:
+                if edge2.endNode in reads_traversed:
                     break
-                elif Redges:                                                # If no anchor nodes have been found we have to continue with read nodes
-                    Redges.sort(key=lambda edge: edge.OS, reverse=True)     # Sort them and take top N to put on the stack
-                    # Redge = Redges[0]
-                    # stack.append(Redge.endNode)
-                    stack += [redge for redge in reversed(Redges[0:N])]     # Place N best edges on the stack in reverse order, so that the best one ends on top
-                    
-                    # KK: this is node at a different place in the code
-                    # path.append(Redge)
-                    # reads_traversed[Redge.endNode.name] = 1
-                else:                                                       # Graph traversal has come to a dead end
-                    try:
-                        edge2 = path.pop()                                      # Remove the last edge from the path
-                        del reads_traversed[rnode.name]                         # Remove current read node from the list of traversed ones
-                    except:
-                        import pdb
-                        pdb.set_trace()
-                        pass
+            else:
+                reached[node.name] = True
+                for edge2 in path[:-1]:
+                    reads_traversed.add(edge2.endNode)
+                paths.append(path)
+            continue
 
+        # All entries popped earlier have lower cost, so the node is only expanded if it has fewer edges
+        if node.name in minedges and minedges[node.name] <= numedges:
+            continue
+        if node in reads_traversed:
+            continue
+        minedges[node.name] = numedges
+
+        if numedges >= HardNodeLimit:
+            continue
+
+        for edge2 in node.outEdges:
+            endNode = edge2.endNode
+            if endNode.nodetype == Node.READ and (endNode in reads_traversed or minedges.get(endNode.name, HardNodeLimit + 1) <= numedges + 1):
+                continue
+            cost2 = edge_cost(edge2, direction, approach)
+            if cost2 is not None:
+                heapq.heappush(heap, (cost + cost2, seqno, (edge2, chain), numedges + 1))
+                seqno += 1
+
+    return paths
+
+
+# 4th Approach
+# For every anchor node and direction of extension, finds the best path to every reachable anchor node
+# (see getBestPaths_from_anchor()), using a priority queue instead of depth first search with backtracking
+# approach determines edge costs: approachMAXOVL uses OVERLAP score and approachMAXEXT uses EXTENSION score
+# Reads used by a path are not used by later paths
+def getPaths_best(anchornodes, approach, output=True):
+    paths = []
+    reads_traversed = new_visited_set()
 
     if output:
-        sys.stdout.write('\nPYHERA: Finishing collecting paths using maximum overlap score!')
+        sys.stdout.write('\nPYHERA: Starting collecting best paths using %s score!' % ('overlap' if approach == approachMAXOVL else 'extension'))
+
+    for aname in sorted(anchornodes.iterkeys()):        # Anchor nodes are processed in a fixed order
+        anode = anchornodes[aname]
+        for direction in (directionRIGHT, directionLEFT):
+            paths += getBestPaths_from_anchor(anode, direction, approach, reads_traversed)
+
+    if output:
+        sys.stdout.write('\nPYHERA: Finishing collecting best paths!')
 
     return paths
 
 
-# 2nd Approach
-# For every anchor node consider all connecting read nodes
-# For further extension consider only the read with the highest EXTENSION score
-def getPaths_maxext(anchornodes, readnodes, crovledges, rrovledges, output=True):
-    paths = []      # A list of paths
-                    # Each path is a list of its own, containing edges that are traversed
-    reads_traversed = {}    # A dictionary of reads that have already been traversed
-                            # Each read can only be used once
-    N = 20           # Number of nodes placed on stack in each steop of graph traversal
+# Runs the first two approaches together, interleaving them for each start edge of each anchor node,
+# so that they share the adjacency of nodes as it is being calculated (see get_adjacency())
+# Each approach keeps its own set of traversed reads, so the paths are the same as when the approaches
+# are run one after another (unless dead ends are shared in memo)
+def getPaths_fused(anchornodes, output=True, memo=None):
+    paths1 = []
+    paths2 = []
+    reads_traversed1 = new_visited_set()
+    reads_traversed2 = new_visited_set()
 
     if output:
-        sys.stdout.write('\nPYHERA: Starting collecting paths using maximum extension score!')
+        sys.stdout.write('\nPYHERA: Starting collecting paths using maximum overlap and extension scores!')
 
-    for (aname, anode) in anchornodes.iteritems():
+    for aname in sorted(anchornodes.iterkeys()):        # Anchor nodes are processed in a fixed order
+        anode = anchornodes[aname]
         for edge in anode.outEdges:
-            path = []               # Initializing a path
-            stack = []              # and a stack for graph traversal
-                                    # A stack will contain a list of edges to be processed
+            path = getPath_from_edge(aname, edge, reads_traversed1, approachMAXOVL, memo)
+            if path is not None:
+                paths1.append(path)
+            path = getPath_from_edge(aname, edge, reads_traversed2, approachMAXEXT, memo)
+            if path is not None:
+                paths2.append(path)
 
-            # For each read determine the direction of extension (LEFT or RIGHT)
-            # Needs to be preserved throughout the path
-            direction = directionLEFT
-            if edge.ESright > edge.ESleft:
-                direction = directionRIGHT
+    if output:
+        sys.stdout.write('\nPYHERA: Finishing collecting paths using maximum overlap and extension scores!')
+
+    return paths1, paths2
 
-            stack.append(edge)      # For each inital node, place only its edge on the stack
-            # In each step of graph traversal:
-            # - Pop the last node
-            # - Check if it can connect to an anchor node
-            # - If it can, the path is complete
-            # - If not, get a number of connected read nodes with the greatest ES and place them on the stack
-            # - If no reads are available, adjust the path and continue
-            while stack:
-                redge = stack.pop()                             # Pop an edge from the stack
-                rnode = redge.endNode                           # And the corresponding node
 
-                # Check if the node from the stack can continue the current path
-                if (len(path) > 0) and (path[-1].endNode != redge.startNode):
-                    # If not, put the edge back on the stack
-                    stack.append(redge)
-                    # And remove the last edge from the path
-                    path.pop()
-                    # Skip to next iteration
+# Score of an edge used to rank paths in beam search, OVERLAP score (approachMAXOVL) or
+# EXTENSION score in a given direction (approachMAXEXT)
+def edge_score(edge, direction, approach):
+    if approach == approachMAXOVL:
+        return edge.OS
+    elif direction == directionRIGHT:
+        return edge.ESright
+    else:
+        return edge.ESleft
+
+
+# Returns a list of edges of a path, represented as a chain (last edge, chain of previous edges)
+def chain_to_path(chain):
+    path = []
+    while chain is not None:
+        path.append(chain[0])
+        chain = chain[1]
+    path.reverse()
+    return path
+
+
+# Finds a path starting with a given edge of anchor node aname, using beam search
+# In each step all paths in the beam are extended by one edge, using the same edges as getPath_from_edge(),
+# and only BeamWidth paths with the highest total score (see edge_score()) are kept, at most one for each read
+# Paths are represented as chains (see chain_to_path()), so that they can share common beginnings
+# Each path in the beam also holds the set of IDs of its reads, built from the set of its parent
+# when the path is kept in the beam, so that reads already in the path are skipped in constant time
+# The search ends when paths reach another anchor node, and the path with the highest score is returned
+# budget is a list [remaining expansions, deadline], shared by all searches from the same anchor node,
+# checked before extending each path in the beam
+# reads_traversed is a set of reads used by paths found so far (see new_visited_set()), which can not be used again
+# Returns None if no other anchor node can be reached
+# If the budget runs out, returns the best path that has reached another anchor node from the paths extended
+# in the current step, or None if there is no such path
+def getPath_beam(aname, edge, reads_traversed, approach, budget):
+    direction = edge_direction(edge)
+
+    # KK: Control
+    if approach == approachMAXOVL and edge.ESright <= 0 and edge.ESleft <= 0:
+        return None
+    if edge.endNode.nodetype != Node.READ or edge.endNode in reads_traversed:
+        return None
+
+    beam = [(edge_score(edge, direction, approach), (edge, None), frozenset((edge.endNode.nodeid,)))]
+    numedges = 1
+    exhausted = False
+    while beam and not exhausted:
+        completed = []                  # Paths that have reached another anchor node
+        extended = {}                   # The best extended path for each read, with the reads of the path
+        for (score, chain, reads_in_path) in beam:
+            if budget[0] <= 0 or time.time() > budget[1]:
+                exhausted = True
+                break
+            budget[0] -= 1
+            rnode = chain[0].endNode
+
+            for edge2 in rnode.outEdges:
+                # KK: Control
+                if approach == approachMAXOVL and edge2.ESright <= 0 and edge2.ESleft <= 0:
+                    continue
+                if edge_direction(edge2) != direction:      # Direction of extension must be maintained
+                    continue
+                endNode = edge2.endNode
+                score2 = score + edge_score(edge2, direction, approach)
+                if endNode.nodetype == Node.ANCHOR:
+                    if endNode.name != aname:               # We only want nodes that are different from the starting node!
+                        completed.append((score2, (edge2, chain)))
                     continue
 
-                # Check if the path is too long skip this iteration and let
-                # the above code eventually reduce the path
-                if len(path) >= HardNodeLimit:
+                if numedges >= HardNodeLimit:
+                    continue
+                if endNode.nodeid in reads_in_path or endNode in reads_traversed:
+                    continue
+                if approach == approachMAXEXT and edge_score(edge2, direction, approach) <= 0:
                     continue
+                if ReachabilityPruning and not can_reach_anchor(endNode, direction, numedges):
+                    continue
+                if endNode.name not in extended or extended[endNode.name][0] < score2:
+                    extended[endNode.name] = (score2, (edge2, chain), reads_in_path)
+
+        if completed:
+            best = completed[0]
+            for item in completed[1:]:
+                if item[0] > best[0]:
+                    best = item
+            return chain_to_path(best[1])
+
+        # Paths are ordered by score, and then by the name of the last read, so that the search is deterministic
+        # Only the paths kept in the beam get their own set of reads
+        beam = sorted(extended.itervalues(), key=lambda item: (-item[0], item[1][0].endNode.name))[:BeamWidth]
+        beam = [(score, chain, reads_in_path | frozenset((chain[0].endNode.nodeid,))) for (score, chain, reads_in_path) in beam]
+        numedges += 1
+
+    return None
+
+
+# Alternative to depth first search in the first two approaches, using beam search (see getPath_beam())
+# Searches from each anchor node are limited to BeamMaxExpansions extended paths and BeamTimeBudget seconds,
+# after which the remaining start edges of the anchor node are skipped
+# Reads used by a path are not used by later paths
+def getPaths_beam(anchornodes, approach, output=True):
+    paths = []
+    reads_traversed = new_visited_set()
+    exhausted = 0
 
-                path.append(redge)                              # Add edge to the path
-                reads_traversed[rnode.name] = 1                 # And mark the node as traversed
+    if output:
+        sys.stdout.write('\nPYHERA: Starting collecting paths using beam search with maximum %s score!' % ('overlap' if approach == approachMAXOVL else 'extension'))
 
-                Aedges = []                                     # Edges to anchor nodes
-                Redges = []                                     # Edges to read nodes
+    for aname in sorted(anchornodes.iterkeys()):        # Anchor nodes are processed in a fixed order
+        anode = anchornodes[aname]
+        budget = [BeamMaxExpansions, time.time() + BeamTimeBudget]
+        for edge in anode.outEdges:
+            if budget[0] <= 0 or time.time() > budget[1]:
+                break
+            path = getPath_beam(aname, edge, reads_traversed, approach, budget)
+            if path is not None:
+                paths.append(path)
+                for edge2 in path[:-1]:
+                    reads_traversed.add(edge2.endNode)
+        if budget[0] <= 0 or time.time() > budget[1]:
+            exhausted += 1
 
-                for edge2 in rnode.outEdges:
-                    endNode = edge2.endNode
-                    if endNode.name in reads_traversed:          # Each read can only be used once
-                        continue
-                    direction2 = directionLEFT
-                    if edge2.ESright > edge2.ESleft:
-                        direction2 = directionRIGHT
-                    if direction2 != direction:                # Direction of extension must be maintained
-                        continue
+    if output:
+        sys.stdout.write('\nPYHERA: Finishing collecting paths using beam search!')
+        if exhausted > 0:
+            sys.stdout.write('\nPYHERA: Search budget ran out for %d anchor nodes!' % exhausted)
 
-                    if endNode.nodetype == Node.ANCHOR:
-                        if endNode.name != aname:               # We only want nodes that are different from the starting node!
-                            Aedges.append(edge2)                # NOTE: this might change, as we migh want scaffold circulat genomes!
-                    elif endNode.nodetype == Node.READ:
-                        Redges.append(edge2)
+    return paths
 
-                if Aedges:                                                  # If anchor nodes have been reached find the best one
-                    if direction == directionLEFT:                          # by sorting them according to ES and taking the first one
-                        Aedges.sort(key=lambda edge: edge.ESleft, reverse=True)
-                    else:
-                        Aedges.sort(key=lambda edge: edge.ESright, reverse=True)
-                    Aedge = Aedges[0]                                       # Create a path and end this instance of tree traversal
-                    path.append(Aedge)
-                    paths.append(path)
-                    break
-                elif Redges:                                                # If no anchor nodes have been found we have to continue with read nodes
-                    if direction == directionLEFT:                          # Sort them and take top N to put on the stack (currently testing with N=1)
-                        Redges.sort(key=lambda edge: edge.ESleft, reverse=True)
-                        stack += [redge for redge in reversed(Redges[0:N]) if redge.ESleft > 0]
-                    else:
-                        Redges.sort(key=lambda edge: edge.ESright, reverse=True)
-                        stack += [redge for redge in reversed(Redges[0:N]) if redge.ESright > 0]
-                    
-                    # stack += [redge for redge in reversed(Redges[0:N])]     # Place N best edges on the stack in reverse orded, so that the best one ends on top
 
-                else:                                                       # Graph traversal has come to a dead end
-                    try:
-                        edge2 = path.pop()                                      # Remove the last edge from the path
-                        del reads_traversed[rnode.name]                         # Remove current read node from the list of traversed ones
-                    except:
-                        import pdb
-                        pdb.set_trace()
-                        pass
+# Start edges of anchor nodes and the approach used, set before starting worker processes
+_path_tasks = []
+_path_approach = approachMAXOVL
+
+# Finds paths for a chunk of start edges, each with its own set of traversed reads
+# Returns a list of encoded paths (see encode_path()), None for start edges without a path
+def getPaths_chunk(chunk):
+    (first, last) = chunk
+    enc_paths = []
+    reads_traversed = new_visited_set()
+    for (aname, edge) in _path_tasks[first:last]:
+        reads_traversed.clear()
+        path = getPath_from_edge(aname, edge, reads_traversed, _path_approach, {} if DeadEndMemo else None)
+        enc_paths.append(encode_path(path) if path is not None else None)
+
+    return enc_paths
+
+
+# Deterministic approaches (approachMAXOVL or approachMAXEXT) with isolated traversal state
+# Each start edge of each anchor node is processed independently, with its own set of traversed reads,
+# so that the result does not depend on the order in which start edges are processed
+# Start edges are distributed among numthreads worker processes and the results are merged
+# in the order of anchor node names and their edges, regardless of the number of processes
+# If DeadEndMemo is set, each start edge uses its own dictionary of dead ends, for the same reason
+def getPaths_isolated(anchornodes, readnodes, approach, numthreads=1, output=True):
+    global _path_tasks, _path_approach
+
+    if output:
+        sname = 'overlap' if approach == approachMAXOVL else 'extension'
+        sys.stdout.write('\nPYHERA: Starting collecting paths using maximum %s score in %d processes!' % (sname, numthreads))
+
+    _path_tasks = []
+    for aname in sorted(anchornodes.iterkeys()):
+        for edge in anchornodes[aname].outEdges:
+            _path_tasks.append((aname, edge))
+    _path_approach = approach
+
+    paths = []
+    if numthreads > 1 and len(_path_tasks) > 1:
+        edges = _edge_table
+        chunk_size = int(math.ceil(float(len(_path_tasks))/(4*numthreads)))
+        chunks = [(i, i+chunk_size) for i in xrange(0, len(_path_tasks), chunk_size)]
+        pool = multiprocessing.Pool(numthreads)
+        results = pool.map(getPaths_chunk, chunks)
+        pool.close()
+        pool.join()
+        for enc_paths in results:
+            paths += [decode_path(code, edges) for code in enc_paths if code is not None]
+    else:
+        reads_traversed = new_visited_set()
+        for (aname, edge) in _path_tasks:
+            reads_traversed.clear()
+            path = getPath_from_edge(aname, edge, reads_traversed, approach, {} if DeadEndMemo else None)
+            if path is not None:
+                paths.append(path)
+
+    if output:
+        sys.stdout.write('\nPYHERA: Finishing collecting paths using maximum %s score!' % sname)
+
+    return paths
+
+
+# Builds the adjacency of a node for extending it in a given direction, shared by all approaches
+# Contains (Aedges, Redges, Rzero, cumES, zero_anchor):
+# - Aedges: for each approach, edges to anchor nodes in the order in which they are considered, by OVERLAP score
+#   (approachMAXOVL) or by EXTENSION score (approachMAXEXT, approachMC), best first
+#   Edges with no positive extension score are only used by approachMAXEXT
+# - Redges: for each approach, edges to read nodes with positive extension score, by OVERLAP score (approachMAXOVL),
+#   by EXTENSION score (approachMAXEXT) or in their original order (approachMC)
+# - Rzero: edges to read nodes with no positive extension score
+# - cumES: cumulative extension scores of Redges[approachMC], used for weighted random sampling
+# - zero_anchor: True if there are edges to anchor nodes with no positive extension score
+# If ReachabilityPruning is set, edges to reads from which no anchor node can be reached are left out
+def build_adjacency(node, direction):
+    Aedges_all = []
+    Aedges_pos = []
+    Redges = []
+    Rzero = []
+    cumES = []
+    totalES = 0.0
+    zero_anchor = False
+
+    for edge in node.outEdges:
+        if edge_direction(edge) != direction:
+            continue
+        ES = edge.ESleft if direction == directionLEFT else edge.ESright
+        endNode = edge.endNode
+        if endNode.nodetype == Node.ANCHOR:
+            Aedges_all.append(edge)
+            # KK: control
+            if edge.ESleft <= 0 and edge.ESright <= 0:
+                zero_anchor = True
+            else:
+                Aedges_pos.append(edge)
+        elif endNode.nodetype == Node.READ:
+            if ReachabilityPruning and endNode.anchordist[direction] is None:
+                continue
+            if ES > 0:
+                Redges.append(edge)
+                totalES += ES
+                cumES.append(totalES)
+            else:
+                Rzero.append(edge)
+        else:
+            sys.stderr.write("PYHERA: ERROR - invalid node type: %d" % endNode.nodetype)
+
+    if direction == directionLEFT:
+        ESkey = lambda edge: edge.ESleft
+    else:
+        ESkey = lambda edge: edge.ESright
+    OSkey = lambda edge: edge.OS
+
+    Aedges = {approachMAXOVL : sorted(Aedges_pos, key=OSkey, reverse=True),
+              approachMAXEXT : sorted(Aedges_all, key=ESkey, reverse=True),
+              approachMC : sorted(Aedges_pos, key=ESkey, reverse=True)}
+    Redges = {approachMAXOVL : sorted(Redges, key=OSkey, reverse=True),
+              approachMAXEXT : sorted(Redges, key=ESkey, reverse=True),
+              approachMC : Redges}
+
+    return (Aedges, Redges, Rzero, cumES, zero_anchor)
+
+
+# Adjacency of nodes, (node name, direction) -> adjacency (see build_adjacency())
+# It is calculated when a node is first visited, and shared by all approaches
+# Must be reset (see reset_adjacency()) if the graph changes
+_adjacency = {}
+
+def get_adjacency(node, direction):
+    key = (node.name, direction)
+    adjacency = _adjacency.get(key)
+    if adjacency is None:
+        adjacency = _adjacency[key] = build_adjacency(node, direction)
+    return adjacency
+
+
+def reset_adjacency():
+    global _adjacency
+    _adjacency = {}
+
+
+# Randomly selects an edge to a read node that has not been traversed, with the probability
+# of selection proportional to extension score
+# The edge is found by binary search in cumulative extension scores, edges to already traversed
+# reads are rejected and sampling is repeated. After too many rejections, sampling is done only
+# among edges to reads that have not been traversed
+# Returns None if all reads have already been traversed
+def sample_edge(Redges, cumES, reads_traversed, rng):
+    MaxRejections = 8
+
+    marks = reads_traversed.marks
+    epoch = reads_traversed.epoch
+    totalES = cumES[-1]
+    for i in xrange(MaxRejections):
+        redge = Redges[bisect.bisect_left(cumES, rng.random()*totalES)]
+        if marks[redge.endNode.nodeid] != epoch:
+            return redge
+
+    avail_Redges = []
+    avail_cumES = []
+    totalES = 0.0
+    for k in xrange(len(Redges)):
+        redge = Redges[k]
+        if marks[redge.endNode.nodeid] != epoch:
+            avail_Redges.append(redge)
+            totalES += cumES[k] - (cumES[k-1] if k > 0 else 0.0)
+            avail_cumES.append(totalES)
+    if not avail_Redges:
+        return None
+
+    return avail_Redges[bisect.bisect_left(avail_cumES, rng.random()*totalES)]
+
+
+# A single iteration of the Monte Carlo approach
+# Randomly chooses an anchor node (from the list anames) and its edge, and tries to find a path
+# to another anchor node by randomly selecting reads for each extension
+# rng is a random number generator (random module or random.Random instance)
+# reads_traversed is a set of reads that have already been traversed (see new_visited_set()), each read can only be used once
+# Edges of read nodes are taken from their adjacency (see get_adjacency()), anchor_tables is used to cache
+# cumulative extension scores for anchor nodes
+# memo is an optional dictionary of dead ends found by the first two approaches (see getPath_from_edge()),
+# only dead ends valid for all approaches are used
+# The summary of the path is maintained while edges are added and removed (see finish_path())
+# Returns the found path (an EdgePath), or None
+def getPath_MC(anchornodes, anames, rng, reads_traversed, anchor_tables, memo=None):
+    N = 10
+
+    # Randomly choose an anchor node
+    aname = rng.choice(anames)
+    anode = anchornodes[aname]
+
+    if len(anode.outEdges) == 0:                            # Skip nodes that have no edges (NOTE: this can probably be removed since such nodes have been discarded)
+        return None
+    if aname not in anchor_tables:
+        totalES_A = 0.0
+        cumES_A = []                                        # Used to randomly select an edge to use
+        for edge in anode.outEdges:                         # Calculate total Extension score, for random selection
+            maxES = edge.ESleft if edge.ESleft > edge.ESright else edge.ESright
+            totalES_A += maxES
+            cumES_A.append(totalES_A)
+        anchor_tables[aname] = cumES_A
+    cumES_A = anchor_tables[aname]
+
+    rand = rng.random()*cumES_A[-1]
+    edge = anode.outEdges[bisect.bisect_left(cumES_A, rand)]
+    # KK: control
+    if edge.ESleft <= 0 and edge.ESright <= 0:
+        return None
+
+    path = []               # Initializing a path
+    lengths = [0]           # Prefix sums of extensions and SIs of edges in the path
+    SIsums = [0]
+    stack = []              # and a stack for graph traversal
+                            # A stack will contain a list of edges to be processed
+
+    # For each read determine the direction of extension (LEFT or RIGHT)
+    # Needs to be preserved throughout the path
+    direction = edge_direction(edge)
+    if memo is not None and edge.endNode.nodetype == Node.READ and lookup_deadend(memo, edge.endNode, direction, aname, None) is not None:
+        return None
+
+    stack.append(edge)      # For each inital node, place only its edge on the stack
+    # In each step of graph traversal:
+    # - Pop the last node
+    # - Check if it can connect to an anchor node
+    # - If it can, the path is complete
+    # - If not, randomly generate a number of connected read nodes with the probability of generation
+    #   proportional to ES and place them on the stack
+    # - If no reads are available, adjust the path and continue
+    while stack:
+        redge = stack.pop()                             # Pop an edge from the stack
+        rnode = redge.endNode                           # And the corresponding node
+
+        # Check if the node from the stack can continue the current path
+        if (len(path) > 0) and (path[-1].endNode != redge.startNode):
+            # If not, put the edge back on the stack
+            stack.append(redge)
+            # And remove the last edge from the path
+            path.pop()
+            del lengths[-1], SIsums[-1]
+            # Skip to next iteration
+            continue
+
+        # Check if the path is too long skip this iteration and let
+        # the above code eventually reduce the path
+        if len(path) >= HardNodeLimit:
+            continue
+
+        path.append(redge)                              # Add edge to the path
+        push_path_metrics(lengths, SIsums, redge, direction)
+        reads_traversed.add(rnode)                      # And mark the node as traversed
+
+        (Aedges, Redges, Rzero, cumES, zero_anchor) = get_adjacency(rnode, direction)
+        Redges = Redges[approachMC]
+
+        # If anchor nodes have been reached take the best one (Aedges are sorted according to ES)
+        Aedge = None
+        for edge2 in Aedges[approachMC]:
+            if edge2.endNode.name != aname:             # We only want nodes that are different from the starting node!
+                Aedge = edge2                           # NOTE: this might change, as we migh want scaffold circulat genomes!
+                break
+
+        redge = None
+        if Aedge is None and Redges:
+            redge = sample_edge(Redges, cumES, reads_traversed, rng)
+
+        if Aedge is not None:                                       # Create a path and end this instance of tree traversal
+            path.append(Aedge)
+            push_path_metrics(lengths, SIsums, Aedge, direction)
+            return finish_path(path, direction, lengths, SIsums)
+        elif redge is not None:                                     # If no anchor nodes have been found we have to continue with read nodes
+            next_edges = [redge]                                    # Randomly select N to put on the stack
+            for j in range(N-1):                                    # NOTE: currently its possible for the same node to be placed more than once
+                next_edges.append(sample_edge(Redges, cumES, reads_traversed, rng))
+            if memo is not None:                                    # Reads that are known dead ends are not searched
+                next_edges = [redge2 for redge2 in next_edges if lookup_deadend(memo, redge2.endNode, direction, aname, None) is None]
+            stack += next_edges
+        else:                                                       # Graph traversal has come to a dead end
+            try:
+                edge2 = path.pop()                                      # Remove the last edge from the path
+                del lengths[-1], SIsums[-1]
+                reads_traversed.discard(rnode)                          # Remove current read node from the set of traversed ones
+            except:
+                import pdb
+                pdb.set_trace()
+                pass
+
+    return None
+
+
+# Key of the group in which a path will be placed by group_paths() and filter_path_groups(), and its length bucket
+# Groups are counted in RIGHT direction (paths extending to the LEFT are reversed)
+# Fixed length buckets of 1000 bases approximate the buckets used by finalize_paths()
+def path_group_key(path):
+    (length, numNodes, sname, ename, direction, SIavg) = calc_path_info(path)
+    if direction == directionLEFT:
+        (sname, ename) = (ename, sname)
+    return (sname, ename), length // 1000
+
+
+# Counts a path in group_counts, a dictionary (sname, ename) -> {length bucket : number of paths}
+def count_path_group(group_counts, path):
+    (group, bucket) = path_group_key(path)
+    buckets = group_counts.setdefault(group, {})
+    buckets[bucket] = buckets.get(bucket, 0) + 1
+
+
+# Checks if the largest of the given counts leads the second largest by more than z standard deviations
+# (assuming that a path falls into one of the two with equal probability)
+def leader_is_stable(counts, z):
+    counts = sorted(counts, reverse=True)
+    first = counts[0]
+    second = counts[1] if len(counts) > 1 else 0
+    return first - second > z * math.sqrt(first + second)
+
+
+# Checks if path groups are stable, i.e. for each side of each anchor node the largest group
+# connecting it to another anchor, and the largest length bucket in that group, are stable
+def path_groups_stable(group_counts, z):
+    sides = {}
+    for (group, buckets) in group_counts.iteritems():
+        total = sum(buckets.itervalues())
+        sides.setdefault((group[0], directionRIGHT), []).append((total, group))
+        sides.setdefault((group[1], directionLEFT), []).append((total, group))
 
-    if output:
-        sys.stdout.write('\nPYHERA: Finishing collecting paths using maximum extension score!')
+    for side_groups in sides.itervalues():
+        if not leader_is_stable([total for (total, group) in side_groups], z):
+            return False
+        (total, group) = max(side_groups)
+        if not leader_is_stable(group_counts[group].values(), z):
+            return False
+
+    return True
 
-    return paths
 
 # 3rd Approach
 # Monte Carlo method - randomly select reads for each extension
 # probability of selecting a read is proportional to extension score
-def getPaths_MC(anchornodes, readnodes, crovledges, rrovledges, numpaths, output=True):
-    paths = []      # A list of paths
+# Edges and cumulative extension scores of each node and direction are taken from its adjacency (see get_adjacency())
+# If group_counts is given (see count_path_group()), sampling is adaptive: numpaths is the minimum number of paths,
+# and sampling stops when path groups become stable (see path_groups_stable())
+# memo is an optional dictionary of dead ends (see getPath_MC())
+# If sink is given (e.g. a PathAggregator), found paths are appended to it instead of a new list, which is returned
+def getPaths_MC(anchornodes, readnodes, crovledges, rrovledges, numpaths, output=True, group_counts=None, memo=None, sink=None):
+    paths = [] if sink is None else sink    # A list of paths
                     # Each path is a list of its own, containing edges that are traversed
-    reads_traversed = {}    # A dictionary of reads that have already been traversed
-                            # Each read can only be used once
-                            # NOTE: should this be used with Monte Carlo!
+    numfound = 0
+    reads_traversed = new_visited_set()     # A set of reads that have already been traversed
+                                            # Each read can only be used once
+                                            # NOTE: should this be used with Monte Carlo!
 
-    N = 10
-    max_iterations = 10000
     iteration = 0
     igoal = 1000
     random.seed()
     if output:
         sys.stdout.write('\nPYHERA: Starting collecting paths using Monte Carlo method!')
         sys.stdout.write('\nITERATIONS:')
-    anames = anchornodes.keys()
-    while len(paths) < numpaths and iteration < max_iterations:
+    anames = sorted(anchornodes.keys())
+
+    anchor_tables = {}          # Cumulative extension scores for anchor nodes
+
+    stable_checks = 0
+    while (group_counts is not None or numfound < numpaths) and iteration < MaxMCIterations:
         iteration += 1
         if output and iteration > igoal:
             sys.stdout.write(' %d' % igoal)
             igoal += 1000
-        # Randomly choose an anchor node
-        aname = random.choice(anames)
-        anode = anchornodes[aname]
-    
-        totalES_A = 0.0
-        problist_A = []                                         # Used to randomly select an edge to use
-        problist_A.append(totalES_A)
-        if len(anode.outEdges) == 0:                            # Skip nodes that have no edges (NOTE: this can probably be removed since such nodes have been discarded)
-            continue
-        for edge in anode.outEdges:                             # Calculate total Extension score, for random selection
-            maxES = edge.ESleft if edge.ESleft > edge.ESright else edge.ESright
-            totalES_A += maxES
-            problist_A.append(totalES_A)
 
-        rand = random.random()*totalES_A
-        k=1
-        try:
-            while problist_A[k] < rand:
-                k += 1
-        except:
-            import pdb
-            pdb.set_trace()
-            pass
+        path = getPath_MC(anchornodes, anames, random, reads_traversed, anchor_tables, memo)
+        if path is not None:
+            paths.append(path)
+            numfound += 1
+            if group_counts is not None:
+                count_path_group(group_counts, path)
 
-        edge = anode.outEdges[k-1]
-        # KK: control
-        if edge.ESleft <= 0 and edge.ESright <= 0:
-            continue
+        if group_counts is not None and iteration % MCCheckInterval == 0 and numfound >= numpaths:
+            stable_checks = stable_checks + 1 if path_groups_stable(group_counts, MCConvergenceZ) else 0
+            if stable_checks >= MCStableChecks:
+                break
 
-        path = []               # Initializing a path
-        stack = []              # and a stack for graph traversal
-                                # A stack will contain a list of edges to be processed
-
-        # For each read determine the direction of extension (LEFT or RIGHT)
-        # Needs to be preserved throughout the path
-        direction = directionLEFT
-        if edge.ESright > edge.ESleft:
-            direction = directionRIGHT
-
-        stack.append(edge)      # For each inital node, place only its edge on the stack
-        # In each step of graph traversal:
-        # - Pop the last node
-        # - Check if it can connect to an anchor node
-        # - If it can, the path is complete
-        # - If not, randomly generate a number of connected read nodes with the probability of generation
-        #   proportional to ES and place them on the stack
-        # - If no reads are available, adjust the path and continue
-        while stack:
-            redge = stack.pop()                             # Pop an edge from the stack
-            rnode = redge.endNode                           # And the corresponding node
-
-            # Check if the node from the stack can continue the current path
-            if (len(path) > 0) and (path[-1].endNode != redge.startNode):
-                # If not, put the edge back on the stack
-                stack.append(redge)
-                # And remove the last edge from the path
-                path.pop()
-                # Skip to next iteration
-                continue
+    if output:
+        sys.stdout.write('\nPYHERA: Finishing collecting paths using Monte Carlo method!')
+        if group_counts is not None and stable_checks >= MCStableChecks:
+            sys.stdout.write('\nPYHERA: Path groups became stable after %d itterations!' % iteration)
+        elif iteration >= MaxMCIterations:
+            sys.stdout.write('\nPYHERA: Finished by running out of itterations!')
 
-            # Check if the path is too long skip this iteration and let
-            # the above code eventually reduce the path
-            if len(path) >= HardNodeLimit:
-                continue
+    return paths
 
-            path.append(redge)                              # Add edge to the path
-            reads_traversed[rnode.name] = 1                 # And mark the node as traversed
 
-            Aedges = []                                     # Edges to anchor nodes
-            Redges = []                                     # Edges to read nodes
+# Derives a seed for a part of the work (e.g. a block of iterations) from a master seed
+def derive_seed(seed, index):
+    return (seed << 32) + index
 
-            for edge2 in rnode.outEdges:
-                # KK: control
-                if edge2.ESleft <= 0 and edge2.ESright <= 0:
-                    continue
-                endNode = edge2.endNode
-                if endNode.name in reads_traversed:          # Each read can only be used once
-                    continue
-                direction2 = directionLEFT
-                if edge2.ESright > edge2.ESleft:
-                    direction2 = directionRIGHT
-                if direction2 != direction:                # Direction of extension must be maintained
-                    continue
 
-                if endNode.nodetype == Node.ANCHOR:
-                    if endNode.name != aname:               # We only want nodes that are different from the starting node!
-                        Aedges.append(edge2)                # NOTE: this might change, as we migh want scaffold circulat genomes!
-                elif endNode.nodetype == Node.READ:
-                    Redges.append(edge2)
-
-            if Aedges:                                                  # If anchor nodes have been reached find the best one
-                if direction == directionLEFT:                          # by sorting them according to ES and taking the first one
-                    Aedges.sort(key=lambda edge: edge.ESleft, reverse=True)
-                else:
-                    Aedges.sort(key=lambda edge: edge.ESright, reverse=True)
-                Aedge = Aedges[0]                                       # Create a path and end this instance of tree traversal
-                path.append(Aedge)
+# State of a reproducible Monte Carlo run, set before starting worker processes
+# (anchornodes, seed, encode, memo), and a cache of cumulative extension scores for anchor nodes filled by each process
+_mc_state = None
+_mc_anchor_tables = {}
+
+# Runs a block of Monte Carlo iterations, with a random number generator seeded by a seed
+# derived from the master seed and the block number, and its own set of traversed reads
+# Returns a list of (iteration, path) for iterations that have found a path
+# Paths are encoded (see encode_path()) if they are passed between processes
+def getPaths_MC_block(block):
+    (anchornodes, seed, encode, memo) = _mc_state
+
+    rng = random.Random(derive_seed(seed, block))
+    anames = sorted(anchornodes.keys())
+    reads_traversed = new_visited_set()
+    first = block * MCBlockIterations
+    last = min(first + MCBlockIterations, MaxMCIterations)
+
+    results = []
+    for iteration in xrange(first, last):
+        path = getPath_MC(anchornodes, anames, rng, reads_traversed, _mc_anchor_tables, memo)
+        if path is not None:
+            results.append((iteration, encode_path(path) if encode else path))
+
+    return results
+
+
+# 3rd Approach, reproducible version
+# Iterations are split into blocks of MCBlockIterations, each block uses its own random number generator
+# with a seed derived from the master seed, and its own set of traversed reads
+# Blocks are processed by numthreads worker processes, and paths are collected from blocks in order
+# until numpaths paths are found, so that for a given seed the result does not depend on the number of processes
+# If group_counts is given, sampling is adaptive (see getPaths_MC())
+# memo is an optional dictionary of dead ends (see getPath_MC())
+# If sink is given, found paths are appended to it (see getPaths_MC())
+def getPaths_MC_seeded(anchornodes, readnodes, numpaths, seed, numthreads=1, output=True, group_counts=None, memo=None, sink=None):
+    global _mc_state, _mc_anchor_tables
+
+    if output:
+        sys.stdout.write('\nPYHERA: Starting collecting paths using Monte Carlo method (seed %d, %d processes)!' % (seed, numthreads))
+
+    numblocks = int(math.ceil(float(MaxMCIterations)/MCBlockIterations))
+    _mc_anchor_tables = {}
+
+    pool = None
+    if numthreads > 1 and numblocks > 1:
+        edges = _edge_table
+        _mc_state = (anchornodes, seed, True, memo)
+        pool = multiprocessing.Pool(numthreads)
+        block_results = pool.imap(getPaths_MC_block, xrange(numblocks))
+    else:
+        _mc_state = (anchornodes, seed, False, memo)
+        block_results = (getPaths_MC_block(block) for block in xrange(numblocks))
+
+    paths = [] if sink is None else sink
+    numfound = 0
+    iterations = 0
+    stable_checks = 0
+    finished = False
+    for (block, results) in enumerate(block_results):
+        found = dict(results)
+        first = block * MCBlockIterations
+        last = min(first + MCBlockIterations, MaxMCIterations)
+        for iteration in xrange(first, last):
+            if iteration in found:
+                path = decode_path(found[iteration], edges) if pool is not None else found[iteration]
                 paths.append(path)
+                numfound += 1
+                if group_counts is not None:
+                    count_path_group(group_counts, path)
+            iterations = iteration + 1
+
+            if group_counts is None:
+                finished = numfound >= numpaths
+            elif iterations % MCCheckInterval == 0 and numfound >= numpaths:
+                stable_checks = stable_checks + 1 if path_groups_stable(group_counts, MCConvergenceZ) else 0
+                finished = stable_checks >= MCStableChecks
+            if finished:
                 break
-            elif Redges:                                                # If no anchor nodes have been found we have to continue with read nodes
-                totalES = 0.0                                           # Randomly select N to put on the stack
-                problist = []                                        
-                problist.append(totalES)
-                if direction == directionLEFT:                          # Extending to left
-                    for redge in Redges:
-                        totalES += redge.ESleft
-                        problist.append(totalES)
-                else:                                                   # Extending to RIGHT
-                    for redge in Redges:
-                        totalES += redge.ESright
-                        problist.append(totalES)
-                
-                try:
-                    for j in range(N):                                      # Randomly generating N nodes to place on stack
-                        rand = random.random()*totalES                      # NOTE: currently its possible for the same node to be placed more than once
-                        k = 1
-                        while problist[k] < rand:
-                            k += 1
-                        stack.append(Redges[k-1])
-                except:
-                    import pdb
-                    pdb.set_trace()
-                    pass
-            else:                                                       # Graph traversal has come to a dead end
-                try:
-                    edge2 = path.pop()                                      # Remove the last edge from the path
-                    del reads_traversed[rnode.name]                         # Remove current read node from the list of traversed ones
-                except:
-                    import pdb
-                    pdb.set_trace()
-                    pass
+        if finished:
+            break
+
+    if pool is not None:
+        pool.terminate()
+        pool.join()
 
     if output:
-        sys.stdout.write('\nPYHERA: Finishing collecting paths using Monte Carlo method!')
-        if iteration >= max_iterations:
+        sys.stdout.write('\nPYHERA: Finishing collecting paths using Monte Carlo method after %d iterations!' % iterations)
+        if group_counts is not None and finished:
+            sys.stdout.write('\nPYHERA: Path groups became stable after %d itterations!' % iterations)
+        elif not finished:
             sys.stdout.write('\nPYHERA: Finished by running out of itterations!')
 
     return paths
@@ -1067,105 +1992,114 @@ def getPaths_MC_OLD(anchornodes, readnodes, crovledges, rrovledges, numpaths, ou
     return paths
 
 
+# Number of nodes indexed by index_nodes(), nodes removed later keep their IDs
+_num_nodes = 0
+
+# Assigns integer IDs to all nodes in the graph, anchor nodes first and then read nodes
+# Nodes are sorted by name, so that IDs do not depend on the order of dictionaries
+# IDs can be used to index arrays (e.g. bitmaps) instead of using dictionaries keyed by node names
+# Returns the number of indexed nodes
+def index_nodes(anchornodes, readnodes):
+    global _num_nodes
+    nodeid = 0
+    for aname in sorted(anchornodes.iterkeys()):
+        anchornodes[aname].nodeid = nodeid
+        nodeid += 1
+    for rname in sorted(readnodes.iterkeys()):
+        readnodes[rname].nodeid = nodeid
+        nodeid += 1
+    _num_nodes = nodeid
+
+    return nodeid
+
+
+# Creates an empty set of visited nodes (see VisitedSet) for all nodes indexed by index_nodes()
+# Used by path searches to keep track of traversed reads
+def new_visited_set():
+    return VisitedSet(_num_nodes)
+
+
+# Remove a set of readnodes from the graph in bulk
+# Removed nodes are marked as dead in a bitmap indexed by node IDs, and all edge lists
+# are then compacted in a single sweep:
+# - outgoing edges of all anchornodes and remaining readnodes
+# - crovl edges
+# - rrovl edges
+# Returns the number of removed crovl and rrovl edges
+def remove_readnodes(rnames, anchornodes, readnodes, crovledges, rrovledges):
+
+    # Indexing the graph if it was not indexed before
+    numnodes = 0
+    for node in anchornodes.values() + readnodes.values():
+        if node.nodeid < 0:
+            numnodes = index_nodes(anchornodes, readnodes)
+            break
+        if node.nodeid >= numnodes:
+            numnodes = node.nodeid + 1
+
+    # Marking nodes as dead
+    dead = bytearray(numnodes)
+    for rname in rnames:
+        if rname not in readnodes:
+            sys.stderr.write('\nERROR: trying to remove nonexisting read node: %s!' % rname)
+            continue
+        dead[readnodes[rname].nodeid] = 1
+        del readnodes[rname]
+
+    # Compacting outgoing edges, start nodes of these edges are all alive
+    for node in anchornodes.values() + readnodes.values():
+        node.outEdges = [edge for edge in node.outEdges if not dead[edge.endNode.nodeid]]
+
+    numRemovedEdges = len(crovledges) + len(rrovledges)
+    crovledges[:] = [edge for edge in crovledges if not (dead[edge.startNode.nodeid] or dead[edge.endNode.nodeid])]
+    rrovledges[:] = [edge for edge in rrovledges if not (dead[edge.startNode.nodeid] or dead[edge.endNode.nodeid])]
+    numRemovedEdges -= len(crovledges) + len(rrovledges)
+
+    return numRemovedEdges
+
+
 # Remove readnode from the graph
 # - Remove from all anchornodes' outgoing edges
 # - Remove from all readnodes' outgoing edges
 # - remove from readnodes
 # - Remove from crovl edges
 # - remove from rrovl edges
+# To remove many reads, call remove_readnodes() once with all of them
 def remove_readnode(rname, anchornodes, readnodes, crovledges, rrovledges):
 
-    if rname not in readnodes:
-        sys.stderr.write('\nERROR: trying to remove nonexisting read node: %s!' % rname)
-
-    # Fetchng readnode to delete
-    rnode = readnodes[rname]
-
-    numRemovedEdges = 0
-
-    # Removing from crovledges
-    # Not sure if I can remove from the list I am iterating on so doing this instead
-    edgesToRemove = []
-    for edge in crovledges:
-        if edge.startNode == rnode or edge.endNode == rnode:
-            edgesToRemove.append(edge)
-    # Removing selected edges
-    for edgeTR in edgesToRemove:
-        crovledges.remove(edgeTR)
-        numRemovedEdges += 1
-
-    # Removing from rrovledges
-    edgesToRemove = []
-    for edge in rrovledges:
-        if edge.startNode == rnode or edge.endNode == rnode:
-            edgesToRemove.append(edge)
-    # Removing selected edges
-    for edgeTR in edgesToRemove:
-        rrovledges.remove(edgeTR)
-        numRemovedEdges += 1
-
-    # Removing node from readnodes
-    del readnodes[rname]
-
-    # Removing outgoing edges from readnodes
-    for rnode2 in readnodes.itervalues():
-        edgesTR = []
-        for edge in rnode2.outEdges:
-            if edge.startNode == rnode or edge.endNode == rnode:
-                edgesTR.append(edge)
-        for edge in edgesTR:
-            rnode2.outEdges.remove(edge)
-
-    # Removing outgoing edges from anchornodes
-    for anode in anchornodes.itervalues():
-        edgesTR = []
-        for edge in anode.outEdges:
-            if edge.startNode == rnode or edge.endNode == rnode:
-                edgesTR.append(edge)
-        for edge in edgesTR:
-            anode.outEdges.remove(edge)
-
-    return numRemovedEdges
+    return remove_readnodes([rname], anchornodes, readnodes, crovledges, rrovledges)
 
 
 ### Cleaning up the graph
 # - Read nodes can connect only to a single anchor node, with maximum overlap score
 # - removing overlaps for discarded reads
 # - TODO: Anything else I can think of
+# Outgoing edges of each node and the list of contig/read edges are filtered only once,
+# so the cleanup is linear in the number of edges
 def graph_cleanup(anchornodes, readnodes, crovledges, rrovledges, reads_to_discard=None, output=True):
 
     edgesRemoved = 0
 
+    if reads_to_discard is None:
+        reads_to_discard = {}
+
     if output:
         sys.stdout.write('\nPYHERA: Starting graph cleanup!')
         sys.stdout.write('\nPYHERA: Discarding reads ...')
 
     # Discading reads that are in the discard dictionary
-    # To make thing more efficient, have to reverse the logic
     # Discarding from anchornodes
     if output:
         sys.stdout.write('\nPYHERA: Discarding from anchor nodes ...')
     for anode in anchornodes.itervalues():
-        edgesTR = []
-        for edge in anode.outEdges:
-            if edge.endNode.name in reads_to_discard:
-                edgesTR.append(edge)
-        for edge in edgesTR:
-            anode.outEdges.remove(edge)
-            # KK: commented to speed thng up, whether this list will be usefull remain to be seen
-            # crovledges.remove(edge)
+        anode.outEdges = [edge for edge in anode.outEdges if edge.endNode.name not in reads_to_discard]
+        # NOTE: crovledges are not filtered here, whether this list will be usefull remains to be seen
 
     if output:
         sys.stdout.write('\nPYHERA: Discarding from read nodes ...')
     for rnode in readnodes.itervalues():
-        edgesTR = []
-        for edge in rnode.outEdges:
-            if edge.endNode.name in reads_to_discard:
-                edgesTR.append(edge)
-        for edge in edgesTR:
-            rnode.outEdges.remove(edge)
-            # KK: commented to speed thng up, whether this list will be usefull remain to be seen
-            # rrovledges.remove(edge)
+        rnode.outEdges = [edge for edge in rnode.outEdges if edge.endNode.name not in reads_to_discard]
+        # NOTE: rrovledges are not filtered here, whether this list will be usefull remains to be seen
 
     for rname in reads_to_discard.iterkeys():
         if rname in readnodes:
@@ -1184,7 +2118,8 @@ def graph_cleanup(anchornodes, readnodes, crovledges, rrovledges, reads_to_disca
     total = len(readnodes)
     count = 0
     next_step = 0.1
-    # For each readnode discarding all overlap for contigs except the one with the best overlap score
+    # 1. For each readnode determining the anchor node with the best overlap score
+    best_anodes = {}
     for rnode in readnodes.itervalues():
         count += 1
         if output and count > next_step*total:
@@ -1199,39 +2134,106 @@ def graph_cleanup(anchornodes, readnodes, crovledges, rrovledges, reads_to_disca
                 maxOS = edge.OS
                 bestANode = outnode
 
-        # If a read connects to at least one anchor node (bestANode exists)
-        # Remove aonnections to all other anchor nodes
-        # This must be done in 3 places:
-        # - outEdges in other anchor nodes
-        # - outEdges in the readnode
-        # - crovledges (these are the same edges as in first two cases)
         if bestANode is not None:
-            edgesTR = []
-            for edge in rnode.outEdges:
-                if edge.endNode.nodetype == Node.ANCHOR and edge.endNode != bestANode:
-                    edgesTR.append(edge)
-            for edge in edgesTR:
-                rnode.outEdges.remove(edge)
-                crovledges.remove(edge)
-                edgesRemoved += 1
-
-            for anode in anchornodes.itervalues():
-                if anode != bestANode:
-                    edgesTR = []
-                    for edge in anode.outEdges:
-                        if edge.endNode == rnode:
-                            edgesTR.append(edge)
-                    for edge in edgesTR:
-                        anode.outEdges.remove(edge)
-                        crovledges.remove(edge)
-                        edgesRemoved += 1
+            best_anodes[rnode.name] = bestANode
+
+    # 2. If a read connects to at least one anchor node (bestANode exists)
+    # Remove aonnections to all other anchor nodes
+    # This must be done in 3 places:
+    # - outEdges in the readnode
+    # - outEdges in other anchor nodes
+    # - crovledges (these are the same edges as in first two cases)
+    edgesTR = {}
+    for rname, bestANode in best_anodes.iteritems():
+        rnode = readnodes[rname]
+        outEdges = []
+        for edge in rnode.outEdges:
+            if edge.endNode.nodetype == Node.ANCHOR and edge.endNode != bestANode:
+                edgesTR[edge] = 1
+            else:
+                outEdges.append(edge)
+        rnode.outEdges = outEdges
+
+    for anode in anchornodes.itervalues():
+        outEdges = []
+        for edge in anode.outEdges:
+            rname = edge.endNode.name
+            if rname in best_anodes and best_anodes[rname] != anode:
+                edgesTR[edge] = 1
+            else:
+                outEdges.append(edge)
+        anode.outEdges = outEdges
+
+    crovledges[:] = [edge for edge in crovledges if edge not in edgesTR]
+    edgesRemoved += len(edgesTR)
 
     return edgesRemoved
 
 
+# Transitive reduction of the read/read part of the graph
+# For reads A, B and C, where A->B, B->C and A->C all extend in the same direction, the edge A->C
+# is redundant if extending A with B and then B with C gives the same extension as extending
+# A directly with C (within a tolerance of fuzz bases)
+# Edges are first marked and removed only after all nodes are processed, so that the result
+# does not depend on the order of nodes
+# Only edges between two read nodes are removed, edges to and from anchor nodes are kept
+# Returns the number of removed edges
+def transitive_reduction(readnodes, rrovledges, fuzz, output=True):
+
+    if output:
+        sys.stdout.write('\nPYHERA: Starting transitive reduction!')
+
+    edgesTR = {}
+    for rnode in readnodes.itervalues():
+        for direction in (directionLEFT, directionRIGHT):
+            # Edges A->B, extending A with other reads in the current direction
+            redges = {}
+            for edge in rnode.outEdges:
+                if edge.ESleft <= 0 and edge.ESright <= 0:
+                    continue
+                if edge.endNode.nodetype == Node.READ and edge_direction(edge) == direction:
+                    if edge.endNode.name not in redges:
+                        redges[edge.endNode.name] = edge
+
+            for edge1 in redges.itervalues():
+                ext1 = edge_extension(edge1, direction)
+                if ext1 <= 0:
+                    continue
+                # Edges B->C, extending B in the same direction
+                for edge2 in edge1.endNode.outEdges:
+                    cname = edge2.endNode.name
+                    if cname not in redges or cname == rnode.name:
+                        continue
+                    if edge2.ESleft <= 0 and edge2.ESright <= 0:
+                        continue
+                    if edge_direction(edge2) != direction:
+                        continue
+                    ext2 = edge_extension(edge2, direction)
+                    if ext2 <= 0:
+                        continue
+                    edge3 = redges[cname]                               # Edge A->C
+                    if (edge1.Strand == edge2.Strand) != (edge3.Strand == '+'):
+                        continue
+                    if abs(ext1 + ext2 - edge_extension(edge3, direction)) <= fuzz:
+                        edgesTR[edge3] = 1
+
+    for rnode in readnodes.itervalues():
+        rnode.outEdges = [edge for edge in rnode.outEdges if edge not in edgesTR]
+    rrovledges[:] = [edge for edge in rrovledges if edge not in edgesTR]
+
+    if output:
+        sys.stdout.write('\nPYHERA: Transitive reduction removed %d edges!' % len(edgesTR))
+
+    return len(edgesTR)
+
+
 # Returns info on the path
 # Length in bases, number of nodes and names of starting and ending nodes
+# Info of an EdgePath is cached, paths found by traversals already carry it (see finish_path())
 def calc_path_info(path):
+    if isinstance(path, EdgePath) and path.info is not None:
+        return path.info
+
     length = 0
     numNodes = len(path) + 1
     SIsum = 0
@@ -1248,12 +2250,8 @@ def calc_path_info(path):
         direction = directionRIGHT
 
     for edge in path:
-        llength = 0
         SIsum += edge.SI
-        if direction == directionRIGHT:
-            llength = edge.SStart - edge.EStart
-        else:
-            llength = (edge.SLen - edge.SEnd) - (edge.ELen - edge.EEnd)
+        llength = edge_extension(edge, direction)
 
         if llength <= 0:
             sys.stderr.write('\nPYHERA: ERRROR calculating path length!')
@@ -1264,50 +2262,35 @@ def calc_path_info(path):
     length += path[-1].ELen
     SIavg = float(SIsum) / len(path)
 
-    return (length, numNodes, startNode.name, endNode.name, direction, SIavg)
+    info = (length, numNodes, startNode.name, endNode.name, direction, SIavg)
+    if isinstance(path, EdgePath):
+        path.info = info
+    return info
 
 
 # Calculate and return reverse coomplement of a sequence
 def revcomp(seq):
-    rcseq = []
-
-    for char in reversed(seq):
-        if char.upper() in compbase.keys():
-            rcchar = compbase[char.upper()]
-        else:
-            rcchar = 'N'
-        rcseq.append(rcchar)
-
-    return ''.join(rcseq)
+    return seq.translate(comptable)[::-1]
 
 
-# Reverses a path represented by a list of edges
-# Reverses the order of edges and also each edge in the list
+# Reverses a path represented by an EdgePath
+# Reverses the order of edges and also each edge in the path, the reversed path is a view of the original one
 def reversed_path(path):
-    reversed_path = []
-
-    for edge in reversed(path):
-        reversed_edge = edge.reversed()
-        reversed_path.append(reversed_edge)
-
-    return reversed_path
+    return path.reversed()
 
 
-# Generates a fasta sequence for a path consisting of a list of edges
+# Determines segments of node sequences that make up the sequence of a path consisting of a list of edges
 # All edges should extend the path in the same direction, either left or right
-# NOTE: currently the script generates fasta sequences only for nodes extending to the right
-# Each node can be anchor or read node
-# NOTE: anchornodes and readnodes dictionaries are probably not necessary
-#       edges have references to starting and ending nodes
-def generate_fasta_for_path(path, anchornodes, readnodes):
-    seq = []
-
-    # Empty path - return empty sequence
+# Each segment is a tuple (node, beg, end, strand), bases from beg to end of the node sequence,
+# reverse complemented if strand is '-' (beg and end are always positions on the original sequence)
+# Segments are returned in the order in which they appear in the path sequence
+def path_segments(path):
+    # Empty path - no segments
     if len(path) == 0:
-        return ''
+        return deque()
 
     startNode = path[0].startNode
-    seq.append(startNode.seq)
+    segments = deque([(startNode, 0, len(startNode.seq), '+')])
     direction = directionLEFT if path[0].ESleft > path[0].ESright else directionRIGHT
     strand = '+'
 
@@ -1316,89 +2299,93 @@ def generate_fasta_for_path(path, anchornodes, readnodes):
         strand2 = edge.Strand
         if direction2 != direction:
             sys.stderr.write('\nPYHERA ERROR: inconsistent direction in a path!')
-        nextseq = edge.endNode.seq
+        node = edge.endNode
+        seqlen = len(node.seq)
         if strand2 == '-':          # If strand on the edge is "-", switch global strand
             strand = '-' if strand == '+' else '+'
-        if strand == '-':                       # If global strand is '-', meaning different from the original strand
-            nextseq = revcomp(nextseq)          # Work with the reverse complement of the sequence
 
+        # Part of the (reverse complemented if global strand is '-') node sequence extending the path,
+        # slice positions are normalized as in slicing a string
         if direction == directionRIGHT:
             start = edge.EEnd + (edge.SLen-edge.SEnd) + 1
-            if start > len(nextseq):
+            if start > seqlen:
                 sys.stderr.write('\nPYHERA ERROR: !')
-            seq.append(nextseq[start:])
+            (beg, end, step) = slice(start, None).indices(seqlen)
+        else:
+            (beg, end, step) = slice(None, edge.EStart - edge.SStart).indices(seqlen)
+        end = max(beg, end)
+        if strand == '-':                       # Positions on the reverse complement are converted to the original sequence
+            (beg, end) = (seqlen - end, seqlen - beg)
+
+        if direction == directionRIGHT:
+            segments.append((node, beg, end, strand))
+        else:
+            segments.appendleft((node, beg, end, strand))     # Since in this case we are extending to the left, adding to the beginning
+
+    return segments
+
+
+# Builds a sequence from segments (see path_segments()), in a single pass into a buffer of the final length
+def build_sequence(segments):
+    seq = bytearray(sum(end - beg for (node, beg, end, strand) in segments))
+    pos = 0
+    for (node, beg, end, strand) in segments:
+        if strand == '+':
+            seq[pos:pos+end-beg] = buffer(node.seq, beg, end - beg)
         else:
-            end = edge.EStart - edge.SStart 
-            seq.insert(0, nextseq[:end])        # Since in this case we are extending to the left, adding to the beginning of the list
+            seq[pos:pos+end-beg] = revcomp(node.seq[beg:end])
+        pos += end - beg
+
+    return str(seq)
 
-    return ''.join(seq)
+
+# Generates a fasta sequence for a path consisting of a list of edges
+# All edges should extend the path in the same direction, either left or right
+# Each node can be anchor or read node
+# NOTE: anchornodes and readnodes dictionaries are probably not necessary
+#       edges have references to starting and ending nodes
+def generate_fasta_for_path(path, anchornodes, readnodes):
+    return build_sequence(path_segments(path))
 
 
 # A function that receives a list of paths, each path is a list of edges
-# The paths are grouped according to staring node and direction (or ending node),
+# The paths are grouped according to staring and ending node in a single pass, using a dictionary,
 # so that each group can be later processed separately
+# Each path is entered only once, extending to the RIGHT, paths extending to the LEFT are reversed
+# (reversed paths are views of the original ones, see reversed_path())
+# If two anchor nodes are connected in both orders (A-B and B-A, both extending to the RIGHT), the connection
+# is ambiguous and both groups are entered reversed, extending to the LEFT, so that filter_path_groups() discards them
+# Groups are ordered by starting and ending node, paths in each group are in the order of path_list
 def group_paths(path_list, anchornodes):
-    filtered_paths = []
     path_info_groups = []
-
     connected_anodes = {}
-    path_info_list = []
+    right_groups = {}           # Paths extending to the RIGHT for each (sname, ename)
+
     # 1. Collecting path info and calculating connected nodes
     for path in path_list:
         (length, numNodes, sname, ename, direction, SIavg) = calc_path_info(path)
         connected_anodes[sname] = anchornodes[sname]
         connected_anodes[ename] = anchornodes[ename]
-        # path_info_list contains info on all paths, putting it also in reverse order (endnode, startnode)
-        # So that I can use it to quickly determine best connections for each node in left and right direction
-        # Last element of the tuple (index 5) say if the info i in reverse order compared to the path
-        opposite_direction = directionLEFT if direction == directionRIGHT else directionRIGHT
-        path_info_list.append((sname, ename, length, numNodes, direction, SIavg, path))
-        path_info_list.append((ename, sname, length, numNodes, opposite_direction, SIavg, reversed_path(path)))
-
-    if len(path_info_list) == 0:
-        return path_info_groups, connected_anodes
-
-    # 2. Group the paths according to starting node, ending node and direction
-    path_info_list.sort(key=lambda pathinfo: pathinfo[1])               # sort path_info_list first cording to end node
-    path_info_list.sort(key=lambda pathinfo: pathinfo[0])               # and then acording to start node
-    (sname, ename, length, numNodes, direction, SIavg, path) = path_info_list[0]     # Data for the first path
-    left_paths = right_paths = []
-    if direction == directionLEFT:
-        left_paths.append((sname, ename, length, numNodes, direction, SIavg, path))
-    else:
-        right_paths.append((sname, ename, length, numNodes, direction, SIavg, path))
-
-    for (sname2, ename2, length2, numNodes2, direction2, SIavg2, path2) in path_info_list[1:]:
-        if sname2 != sname or ename2 != ename:              # Start or end node has changed, have to wrap up the path group and start a new one
-            if left_paths:
-                path_info_groups.append(left_paths)
-            elif right_paths:
-                path_info_groups.append(right_paths)
-            else:
-                sys.stderr.write('\nPYHERA ERROR while processing paths: left and right groups are empty (%s)!' % sname)
-            left_paths = []
-            right_paths = []
-            sname = sname2              # Numnodes, pathlength, SIavg and path are not used for grouping
-            ename = ename2
-            direction = direction2
-
-        if direction2 == directionLEFT:
-            left_paths.append((sname2, ename2, length2, numNodes2, direction2, SIavg2, path2))
+        if direction == directionLEFT:
+            (sname, ename) = (ename, sname)
+            path = reversed_path(path)
+        right_groups.setdefault((sname, ename), []).append((sname, ename, length, numNodes, directionRIGHT, SIavg, path))
+
+    # 2. Ordering the groups, ambiguous groups are replaced by groups of paths in the other order, reversed
+    for (sname, ename) in sorted(right_groups.iterkeys()):
+        if (ename, sname) in right_groups:
+            pgroup = [(ename2, sname2, length, numNodes, directionLEFT, SIavg, reversed_path(path)) \
+                        for (sname2, ename2, length, numNodes, direction, SIavg, path) in right_groups[(ename, sname)]]
         else:
-            right_paths.append((sname2, ename2, length2, numNodes2, direction2, SIavg2, path2))
+            pgroup = right_groups[(sname, ename)]
+        path_info_groups.append(pgroup)
 
-    # At the end, add the last group to the group list
-    if left_paths:
-        path_info_groups.append(left_paths)
-    elif right_paths:
-        path_info_groups.append(right_paths)
-    else:
-        sys.stderr.write('\nPYHERA ERROR while processing paths: left and right groups are empty (%s)!' % sname)
+    return path_info_groups, connected_anodes
 
-    # import pdb
-    # pdb.set_trace()
 
-    return path_info_groups, connected_anodes
+# Number of paths in a group of pathinfos, including duplicates of distinct paths (see DistinctPaths)
+def group_size(pgroup):
+    return sum(pathinfo[6].count for pathinfo in pgroup)
 
 
 # A function that filters paths
@@ -1412,8 +2399,8 @@ def filter_path_groups(path_groups):
     filtered_groups = []
     discarded_groups = []
 
-    # 1. Since each path is entered twice, once for each direction, we can look only at path
-    # extending in one direction - in this case direction RIGHT
+    # 1. Paths are grouped extending in one direction - in this case direction RIGHT
+    # Groups extending to the LEFT are ambiguous (see group_paths()) and are discarded
     for pgroup in path_groups:
         if pgroup[0][4] == directionRIGHT:
             temp_groups.append(pgroup)
@@ -1422,7 +2409,7 @@ def filter_path_groups(path_groups):
 
     # 2. Sort groups by group size, from larger to smaller
     # For each node retain only the largest group
-    temp_groups.sort(key=lambda group: len(group), reverse=True)
+    temp_groups.sort(key=lambda group: group_size(group), reverse=True)
     used_enodes = {}
     used_snodes = {}
     for pgroup in temp_groups:
@@ -1466,7 +2453,7 @@ def finalize_paths(filtered_groups, paths):
 
         # Sort bucket according to size and choose a largest one
         # Then chose a best representative path from the top bucket
-        buckets.sort(key=lambda bucket: len(bucket), reverse=True)
+        buckets.sort(key=lambda bucket: group_size(bucket), reverse=True)
         bucket = buckets[0]
         bucket.sort(key=lambda pathinfo: pathinfo[5], reverse=True)           # Sort according to SIavg
         final_paths.append(bucket[0])
@@ -1474,78 +2461,263 @@ def finalize_paths(filtered_groups, paths):
     return final_paths
 
 
-# Generate fasta from final paths and write them to a file if specified
-# Contigs not used for scaffolds are written as is
+# Fingerprint of a path, the sequence of its edge IDs in a compact form
+# Reversed paths have different fingerprints
+def path_fingerprint(path):
+    return path.edgeids().tostring()
+
+
+# Collects distinct paths (see --dedup-paths), a path that has already been collected is not stored again,
+# instead its count (see EdgePath) is increased
+# fingerprints maps fingerprints of collected paths (see path_fingerprint()) to the stored paths,
+# it can be shared by several collections, so that each distinct path is stored only in the first one
+# Can be used instead of a list of paths by path generators (see PathAggregator), len() is the number of
+# collected paths including duplicates
+class DistinctPaths:
+    def __init__(self, fingerprints = None):
+        self.paths = []
+        self.fingerprints = {} if fingerprints is None else fingerprints
+        self.numpaths = 0
+
+    def __len__(self):
+        return self.numpaths
+
+    def append(self, path):
+        path = make_path(path)
+        self.numpaths += path.count
+        fingerprint = path_fingerprint(path)
+        stored = self.fingerprints.get(fingerprint)
+        if stored is None:
+            self.fingerprints[fingerprint] = path
+            self.paths.append(path)
+        else:
+            stored.count += path.count
+
+    def extend(self, paths):
+        for path in paths:
+            self.append(path)
+        return self
+
+
+# Summary of a path group used for printing: (sname, ename, direction, number of paths)
+def path_group_summary(pgroup):
+    return (pgroup[0][0], pgroup[0][1], pgroup[0][4], group_size(pgroup))
+
+
+# Collects paths one by one, keeping only a summary of each path group instead of the paths (see --stream-paths)
+# Paths are grouped as in group_paths() and split into fixed length buckets of 1000 bases
+# (see path_group_key()), for each bucket the number of paths and the best path are kept
+# NOTE: finalize_paths() instead starts a new bucket at each path longer than the shortest path
+#       in the current bucket by more than 1000 bases, which requires all path lengths,
+#       so the final paths can differ from those chosen for a list of the same paths
+# Can be used instead of a list of paths by path generators (append() and len()), so that memory
+# is bounded by the number of groups and buckets, rather than by the number of generated paths
+# Since paths are not kept, they are checked when added: the numbers of inconsistent paths
+# (see check_path_consistency()) and, if check_paths is True, of paths with duplicate reads (see check_path()) are counted
+class PathAggregator:
+    def __init__(self, check_paths = False):
+        self.groups = {}            # (sname, ename) -> {bucket : [number of paths, best pathinfo, is reversed]}
+        self.connected = {}         # Anchor nodes connected by paths
+        self.numpaths = 0
+        self.check_paths = check_paths
+        self.numinconsistent = 0
+        self.numinvalid = 0
+
+    def __len__(self):
+        return self.numpaths
+
+    # Adds a path to the bucket of its group, the path with the greatest average SI is kept
+    # (if SIs are equal, the path added first), paths extending to the LEFT are reversed when needed
+    def append(self, path):
+        if not check_path_consistency(path):
+            self.numinconsistent += 1
+        if self.check_paths and not check_path(path):
+            self.numinvalid += 1
+
+        (length, numNodes, sname, ename, direction, SIavg) = calc_path_info(path)
+        self.numpaths += 1
+        self.connected[sname] = 1
+        self.connected[ename] = 1
+        isreversed = direction == directionLEFT
+        if isreversed:
+            (sname, ename) = (ename, sname)
+
+        buckets = self.groups.setdefault((sname, ename), {})
+        bucket = buckets.get(length // 1000)
+        if bucket is None:
+            buckets[length // 1000] = [1, (sname, ename, length, numNodes, directionRIGHT, SIavg, path), isreversed]
+        else:
+            bucket[0] += 1
+            if SIavg > bucket[1][5]:
+                bucket[1] = (sname, ename, length, numNodes, directionRIGHT, SIavg, path)
+                bucket[2] = isreversed
+
+    # Filters path groups as filter_path_groups() does for lists of paths, and determines their representative paths
+    # from the largest fixed length bucket (the one with the shortest paths among the largest)
+    # Returns (group summaries, filtered summaries, discarded summaries, final paths), see path_group_summary()
+    def finalize(self):
+        summaries = []
+        right_groups = []
+        for (sname, ename) in sorted(self.groups.iterkeys()):
+            numpaths = sum(bucket[0] for bucket in self.groups[(sname, ename)].itervalues())
+            if (ename, sname) in self.groups:           # Ambiguous group (see group_paths())
+                numpaths = sum(bucket[0] for bucket in self.groups[(ename, sname)].itervalues())
+                summaries.append((ename, sname, directionLEFT, numpaths))
+            else:
+                summaries.append((sname, ename, directionRIGHT, numpaths))
+                right_groups.append(summaries[-1])
+
+        filtered = []
+        discarded = [summary for summary in summaries if summary[2] == directionLEFT]
+        final_paths = []
+        right_groups.sort(key=lambda summary: summary[3], reverse=True)
+        used_enodes = {}
+        used_snodes = {}
+        for summary in right_groups:
+            (sname, ename, direction, numpaths) = summary
+            if sname in used_snodes or ename in used_enodes:
+                discarded.append(summary)
+                continue
+            filtered.append(summary)
+            used_snodes[sname] = 1
+            used_enodes[ename] = 1
+
+            # The largest bucket, or the one with shortest paths among the largest
+            buckets = self.groups[(sname, ename)]
+            (numpaths, pathinfo, isreversed) = buckets[min(buckets.iterkeys(), key=lambda k: (-buckets[k][0], k))]
+            path = make_path(pathinfo[6])
+            final_paths.append(pathinfo[:6] + (reversed_path(path) if isreversed else path,))
+
+        return summaries, filtered, discarded, final_paths
+
+
+# Links final paths into chains of anchor nodes, where each path links its start node to its end node
+# Final paths use each anchor node at most once as a start node and at most once as an end node,
+# so anchor nodes form simple chains and cycles:
+# - chains are followed from their leftmost anchor node (one that is not the end node of any path),
+#   in the order of used_nodes (a dictionary of all start and end nodes)
+# - each remaining cycle is followed from its anchor node with the smallest name, leaving out the path
+#   that closes the cycle
+# Each path is followed at most once, so linking takes linear time and always terminates
+# Returns a list of chains (list of anchor nodes, list of paths), and the number of broken cycles
+def link_paths(final_paths, used_nodes):
+    path_dict = {}              # Path starting at each anchor node
+    left_nodes = {}             # Start node of the path ending at each anchor node
+    for pathinfo in final_paths:
+        path_dict[pathinfo[0]] = pathinfo
+        left_nodes[pathinfo[1]] = pathinfo[0]
+
+    visited = {}                # Start nodes of paths that have been followed
+    def follow(node):
+        nodelist = [node]
+        paths = []
+        while node in path_dict and node not in visited:
+            visited[node] = 1
+            pathinfo = path_dict[node]
+            node = pathinfo[1]
+            nodelist.append(node)
+            paths.append(pathinfo[6])
+        return (nodelist, paths)
+
+    chains = []
+    for node in used_nodes:
+        if node not in left_nodes:
+            chains.append(follow(node))
+
+    numcycles = 0
+    for node in sorted(path_dict.iterkeys()):
+        if node not in visited:
+            visited[left_nodes[node]] = 1           # The path closing the cycle is not followed
+            chains.append(follow(node))
+            numcycles += 1
+
+    return chains, numcycles
+
+
+# Concatenates paths into a single path (an EdgePath), copying edge IDs only once
+def concat_paths(paths):
+    edgeids = array('i')
+    for path in paths:
+        edgeids.extend(make_path(path).edgeids())
+    return _edge_table.path(edgeids)
+
+
+# Determines the layout of scaffolds from final paths, without building their sequences
+# Linked paths are combined into scaffolds (see link_paths()), and contigs not used for scaffolds are kept as is
+# Returns a list of FASTA headers and a list of segments of the sequence of each scaffold (see path_segments())
 # pathinfo: (sname, ename, length, numNodes, direction, SIavg, path)
-def generate_fasta(final_paths, anchornodes, readnodes, filename = None):
+def scaffold_layout(final_paths, anchornodes):
     # Calculate anchor nodes used for scaffolding
     used_nodes = {}
-    path_dict = {}
     for pathinfo in final_paths:
         sname = pathinfo[0]
         ename = pathinfo[1]
-        path_dict[sname] = pathinfo
         used_nodes[sname] = 1
         used_nodes[ename] = 1
 
     # Combine linked paths
     # Example: If path1 connects node1 and node2, and path2 connects node2 and node3
     #          They are combined into a single path connectind node1 to node3 (via node2)
-    leftmost_nodes = []
-    right_nodes = {}
-    for pathinfo in final_paths:
-        ename = pathinfo[1]
-        right_nodes[ename] = 1
-
-    for node in used_nodes:
-        if node not in right_nodes:
-            leftmost_nodes.append(node)
+    chains, numcycles = link_paths(final_paths, used_nodes)
+    if numcycles > 0:
+        sys.stdout.write('\nPYHERA WARNING: %d circular chains of anchor nodes have been broken!' % numcycles)
 
     combined_paths = {}
-    for node in leftmost_nodes:                     # For each leftmost anchor node (node that is not on the right end in any path)
-        nodelist = []
-        initial_pathinfo = path_dict[node]          # Get the initial path
-        snode = initial_pathinfo[0]                 # Put start and end nodes in node list
-        enode = initial_pathinfo[1]
-        combined_path = initial_pathinfo[6]         # Create the initial combined path as a initial list of edges
-        nodelist.append(snode)
-        nodelist.append(enode)
-
-        while (enode) in path_dict:                 # If the currend end node can be extended further
-            next_pathinfo = path_dict[enode]
-            snode = next_pathinfo[0]
-            enode = next_pathinfo[1]
-            nextpath = next_pathinfo[6]
-            nodelist.append(enode)                  # Append the new end anchor node to the node list
-            combined_path += nextpath[1:]           # Combine the new path with the current combined path
-
-        combined_paths[node] = (nodelist, combined_path)
+    for (nodelist, paths) in chains:
+        combined_path = concat_paths([paths[0]] + [path[1:] for path in paths[1:]])
+        combined_paths[nodelist[0]] = (nodelist, combined_path)
 
     headers = []
-    seqs = []
-    # Generate headers and fasta sequences for each combined path
+    segments_list = []
+    # Generate headers and segments of fasta sequences for each combined path
     i = 1
     for node, (nodelist, combined_path) in combined_paths.iteritems():
         header = 'Scaffold%04d %s' % (i, nodelist[0])
-        seq = generate_fasta_for_path(combined_path, anchornodes, readnodes)
         for node2 in nodelist[1:]:
             header += ',%s' % node2
 
         headers.append(header)
-        seqs.append(seq)
+        segments_list.append(path_segments(combined_path))
         i += 1
 
     # Add unused anchor nodes to the output
     for aname, anode in anchornodes.iteritems():
         if aname not in used_nodes:
             header = '%s' % aname
-            seq = anode.seq
             headers.append(header)
-            seqs.append(seq)
+            segments_list.append([(anode, 0, len(anode.seq), '+')])
+
+    return headers, segments_list
+
+
+# Segments of scaffold sequences (see path_segments()), set before starting worker processes
+# so that the workers can access them, and the sequences of nodes they refer to, without copying
+_scaffold_segments = []
+
+# Builds the sequence of a scaffold from its segments, in a worker process
+def render_scaffold(index):
+    return build_sequence(_scaffold_segments[index])
+
+
+# Builds sequences of scaffolds from their segments and writes them to a file if specified
+# Sequences are built by numthreads worker processes, and are output in the same order
+# regardless of the number of processes
+def render_fasta(headers, segments_list, filename = None, numthreads = 1):
+    global _scaffold_segments
+
+    _scaffold_segments = segments_list
+    if numthreads > 1 and len(_scaffold_segments) > 1:
+        pool = multiprocessing.Pool(numthreads)
+        seqs = pool.map(render_scaffold, xrange(len(_scaffold_segments)))
+        pool.close()
+        pool.join()
+    else:
+        seqs = [build_sequence(segments) for segments in _scaffold_segments]
+    _scaffold_segments = []
 
     # Testing if the generation is correct
     if len(headers) != len(seqs):
-        sys.stderr.write('\nPYHERA ERROR: generating headers (%d) and sequences (%d)!' % (len(headeers), len(seqs)))
+        sys.stderr.write('\nPYHERA ERROR: generating headers (%d) and sequences (%d)!' % (len(headers), len(seqs)))
 
     # Writting output to a file
     if filename is not None:
@@ -1559,6 +2731,412 @@ def generate_fasta(final_paths, anchornodes, readnodes, filename = None):
     return headers, seqs
 
 
+# Generate fasta from final paths and write them to a file if specified
+# Contigs not used for scaffolds are written as is
+# pathinfo: (sname, ename, length, numNodes, direction, SIavg, path)
+def generate_fasta(final_paths, anchornodes, readnodes, filename = None, numthreads = 1):
+    headers, segments_list = scaffold_layout(final_paths, anchornodes)
+    return render_fasta(headers, segments_list, filename, numthreads)
+
+
+# Writes the layout of scaffolds (see scaffold_layout()) to a file in AGP format (version 2.0)
+# Each scaffold is an object made of contigs and reads as components (type W), with coordinates on their
+# original sequences and orientation, empty segments are left out
+# The FASTA header of each scaffold is written in a comment line before its components,
+# so that the same FASTA file can be generated later from the layout (see load_layout() and layout2fasta.py)
+def write_layout(headers, segments_list, filename):
+    file = open(filename, 'w')
+    file.write('##agp-version\t2.0\n')
+    for i in xrange(len(headers)):
+        header = headers[i]
+        objname = header.split(' ')[0]
+        file.write('# FASTA\t%s\n' % header)
+        pos = 0
+        part = 0
+        for (node, beg, end, strand) in segments_list[i]:
+            if end <= beg:
+                continue
+            part += 1
+            file.write('%s\t%d\t%d\t%d\tW\t%s\t%d\t%d\t%s\n' % (objname, pos+1, pos+end-beg, part, node.name, beg+1, end, strand))
+            pos += end - beg
+    file.close()
+
+
+# Loads the layout of scaffolds written by write_layout()
+# nodes is a dictionary of nodes (contigs and reads) that are used as components
+# Returns a list of FASTA headers and a list of segments for each scaffold (see scaffold_layout()),
+# or None if the layout is not valid
+def load_layout(filename, nodes):
+    headers = []
+    segments_list = []
+    objnames = []
+
+    for line in open(filename):
+        line = line.rstrip('\n')
+        if line.startswith('# FASTA\t'):
+            headers.append(line[len('# FASTA\t'):])
+            segments_list.append([])
+            objnames.append(headers[-1].split(' ')[0])
+            continue
+        if line == '' or line.startswith('#'):
+            continue
+
+        fields = line.split('\t')
+        if len(fields) < 9 or fields[4] != 'W':
+            sys.stderr.write('\nERROR: invalid layout line: %s' % line)
+            return None
+        if not objnames or fields[0] != objnames[-1]:
+            sys.stderr.write('\nERROR: component of an unknown scaffold: %s' % line)
+            return None
+        if fields[5] not in nodes:
+            sys.stderr.write('\nERROR: unknown component: %s' % fields[5])
+            return None
+        node = nodes[fields[5]]
+        beg = int(fields[6]) - 1
+        end = int(fields[7])
+        if beg < 0 or end > len(node.seq) or beg >= end or fields[8] not in ('+', '-'):
+            sys.stderr.write('\nERROR: invalid component coordinates: %s' % line)
+            return None
+        segments_list[-1].append((node, beg, end, fields[8]))
+
+    return headers, segments_list
+
+
+
+# Collects paths using all three approaches, and the fourth one if best is True
+# Returns the lists of paths for each approach, and the number of paths of the fourth approach found using
+# OVERLAP score, which come before those found using EXTENSION score
+# minMCpaths is the minimum number of paths generated by the Monte Carlo approach
+# If isolated is True, first two approaches process each start edge with its own traversal state,
+# using numthreads processes (see getPaths_isolated())
+# If seed is given, the Monte Carlo approach is reproducible and uses numthreads processes (see getPaths_MC_seeded())
+# If adaptive is True, the Monte Carlo approach generates at least minMCpaths paths and stops when path groups
+# (including paths from the first two approaches) become stable
+# If best is True, the fourth approach finds best paths between anchor nodes (see getPaths_best()),
+# after the other approaches, so that it does not change their paths or the number of Monte Carlo paths
+# If BeamSearch is set, the first two approaches use beam search (see getPaths_beam())
+# If FusedPaths is set, the first two approaches are run together (see getPaths_fused())
+# If DeadEndMemo is set, dead ends found by the first two approaches are shared with later searches
+# If aggregator is given (see PathAggregator), all paths are added to it and are not kept otherwise
+# (empty lists are returned for all approaches)
+# If DedupPaths is set (and aggregator is not given), each distinct path is returned only once, by the approach
+# that has generated it first, with the number of times it was generated by all approaches (see DistinctPaths)
+def collect_paths(anchornodes, readnodes, crovledges, rrovledges, minMCpaths, output=True, isolated=False, numthreads=1, seed=None, adaptive=False, best=False, aggregator=None):
+    memo = {} if DeadEndMemo else None
+
+    # 1. Approach
+    # For every anchor node consider all connecting read nodes
+    # For further extension consider only the read with the highest OVERLAP score
+    if BeamSearch:
+        paths1 = getPaths_beam(anchornodes, approachMAXOVL, output)
+    elif isolated:
+        paths1 = getPaths_isolated(anchornodes, readnodes, approachMAXOVL, numthreads, output)
+    elif FusedPaths:
+        paths1, paths2 = getPaths_fused(anchornodes, output, memo)
+    else:
+        paths1 = getPaths_maxovl(anchornodes, readnodes, crovledges, rrovledges, output, memo)
+    if output:
+        sys.stdout.write('\nPYHERA: Approach 1 returned %d paths!\n' % len(paths1))
+
+
+    # 2. Approach
+    # For every anchor node consider all connecting read nodes
+    # For further extension consider only the read with the highest EXTENSION score
+    if BeamSearch:
+        paths2 = getPaths_beam(anchornodes, approachMAXEXT, output)
+    elif isolated:
+        paths2 = getPaths_isolated(anchornodes, readnodes, approachMAXEXT, numthreads, output)
+    elif FusedPaths:
+        pass                # Already calculated together with the first approach
+    else:
+        paths2 = getPaths_maxext(anchornodes, readnodes, crovledges, rrovledges, output, memo)
+    if output:
+        sys.stdout.write('\nPYHERA: Approach 2 returned %d paths!\n' % len(paths2))
+
+    # 3. Approach
+    # Monte Carlo method - randomly select reads for each extension
+    # probability of selecting a read is proportional to extension score
+    # This approach must generate more paths then first two approaches combined
+    numMCpaths = 2*(len(paths1) + len(paths2) + 1)
+    if numMCpaths < minMCpaths:
+        numMCpaths = minMCpaths
+    group_counts = None
+    if adaptive:
+        numMCpaths = minMCpaths
+        group_counts = {}
+        for path in paths1 + paths2:
+            count_path_group(group_counts, path)
+    sink = None
+    if aggregator is not None:
+        for path in paths1 + paths2:
+            aggregator.append(path)
+        sink = aggregator
+        numaggregated = len(aggregator)
+        paths1 = []
+        paths2 = []
+    elif DedupPaths:
+        fingerprints = {}
+        paths1 = DistinctPaths(fingerprints).extend(paths1).paths
+        paths2 = DistinctPaths(fingerprints).extend(paths2).paths
+        sink = DistinctPaths(fingerprints)
+    if seed is None:
+        paths3 = getPaths_MC(anchornodes, readnodes, crovledges, rrovledges, numMCpaths, output, group_counts, memo, sink)
+    else:
+        paths3 = getPaths_MC_seeded(anchornodes, readnodes, numMCpaths, seed, numthreads, output, group_counts, memo, sink)
+    if aggregator is not None:
+        if output:
+            sys.stdout.write('\nPYHERA: Approach 3 returned %d paths!\n' % (len(aggregator) - numaggregated))
+        paths3 = []
+    else:
+        if output:
+            sys.stdout.write('\nPYHERA: Approach 3 returned %d paths!\n' % len(paths3))
+        if sink is not None:
+            paths3 = sink.paths
+
+    # 4. Approach
+    # For every anchor node and direction find the best path to every reachable anchor node,
+    # using both OVERLAP and EXTENSION score
+    paths4 = []
+    numbest = 0             # Number of paths at the beginning of paths4 that are found using OVERLAP score
+    if best:
+        paths4ovl = getPaths_best(anchornodes, approachMAXOVL, output)
+        paths4ext = getPaths_best(anchornodes, approachMAXEXT, output)
+        if output:
+            sys.stdout.write('\nPYHERA: Approach 4 returned %d paths!\n' % (len(paths4ovl) + len(paths4ext)))
+        if aggregator is not None:
+            for path in paths4ovl + paths4ext:
+                aggregator.append(path)
+        else:
+            if DedupPaths:
+                paths4ovl = DistinctPaths(fingerprints).extend(paths4ovl).paths
+                paths4ext = DistinctPaths(fingerprints).extend(paths4ext).paths
+            paths4 = paths4ovl + paths4ext
+            numbest = len(paths4ovl)
+
+    if aggregator is None and DedupPaths and output:
+        numpaths = sum(path.count for path in paths1 + paths2 + paths3 + paths4)
+        sys.stdout.write('\nPYHERA: %d distinct paths out of %d generated!\n' % (len(paths1) + len(paths2) + len(paths3) + len(paths4), numpaths))
+
+    # Paths are stored as arrays of edge IDs
+    paths1 = [make_path(path) for path in paths1]
+    paths2 = [make_path(path) for path in paths2]
+    paths3 = [make_path(path) for path in paths3]
+    paths4 = [make_path(path) for path in paths4]
+
+    return paths1, paths2, paths3, paths4, numbest
+
+
+# Assigns integer IDs to all edges in the graph (outgoing edges of anchor and read nodes)
+# Returns a list of edges indexed by their IDs
+def index_edges(anchornodes, readnodes):
+    edges = []
+    for nodes in (anchornodes, readnodes):
+        for name in sorted(nodes.iterkeys()):
+            for edge in nodes[name].outEdges:
+                edge.edgeid = len(edges)
+                edges.append(edge)
+
+    return edges
+
+
+# Table of all edges in the graph (see EdgeTable), used by paths stored as arrays of edge IDs
+# Created before searching for paths, so that worker processes can access it without copying
+_edge_table = None
+
+# Assigns IDs to all edges in the graph and creates the table of edges
+def create_edge_table(anchornodes, readnodes):
+    global _edge_table
+    _edge_table = EdgeTable(index_edges(anchornodes, readnodes))
+    return _edge_table
+
+
+# Converts a path given as a list of edges into an EdgePath, using the table of edges
+def make_path(path):
+    if isinstance(path, EdgePath):
+        return path
+    return _edge_table.path([edge.edgeid for edge in path])
+
+
+# Encodes a path as a list of edge IDs, so that it can be passed between processes,
+# together with its count, summary and results of checks (see EdgePath)
+# Reversed edges have negative IDs (complements of the original edge ID)
+def encode_path(path):
+    if isinstance(path, EdgePath):
+        return (path.edgeids(), path.count, path.info, path.consistent, path.valid)
+    return ([edge.edgeid for edge in path], 1, None, None, None)
+
+
+# Decodes a path encoded by encode_path(), using the table of edges
+def decode_path(code, table):
+    (codes, count, info, consistent, valid) = code
+    path = table.path(codes)
+    path.count = count
+    path.info = info
+    path.consistent = consistent
+    path.valid = valid
+    return path
+
+
+# Finds connected components of the graph, edges are treated as undirected
+# Returns a list of components, each component is a tuple of dictionaries (anchornodes, readnodes)
+# Only components with at least two anchor nodes are returned, because paths connect two
+# different anchor nodes. Components are ordered by the name of their first anchor node
+def find_components(anchornodes, readnodes):
+    nodes = anchornodes.values() + readnodes.values()
+    numnodes = 0
+    for node in nodes:
+        if node.nodeid >= numnodes:
+            numnodes = node.nodeid + 1
+
+    # Disjoint sets of node IDs
+    parent = range(numnodes)
+    def find(nodeid):
+        while parent[nodeid] != nodeid:
+            parent[nodeid] = parent[parent[nodeid]]
+            nodeid = parent[nodeid]
+        return nodeid
+
+    for node in nodes:
+        root1 = find(node.nodeid)
+        for edge in node.outEdges:
+            root2 = find(edge.endNode.nodeid)
+            if root1 != root2:
+                parent[root2] = root1
+
+    components = {}
+    for nodes_dict, idx in ((anchornodes, 0), (readnodes, 1)):
+        for name, node in nodes_dict.iteritems():
+            root = find(node.nodeid)
+            if root not in components:
+                components[root] = ({}, {})
+            components[root][idx][name] = node
+
+    components = [component for component in components.itervalues() if len(component[0]) > 1]
+    components.sort(key=lambda component: min(component[0].iterkeys()))
+
+    return components
+
+
+# Components of the graph, set before starting worker processes
+# so that the workers can access them without copying
+_components = []
+
+# Path search, grouping, filtering and selection of final paths for a single component
+# Returns the results with all paths encoded by encode_path()
+# pathinfo: (sname, ename, length, numNodes, direction, SIavg, path)
+def scaffold_component(compidx):
+    (anchornodes, readnodes, minMCpaths, isolated, seed, adaptive, best) = _components[compidx]
+
+    paths1, paths2, paths3, paths4, numbest = collect_paths(anchornodes, readnodes, None, None, minMCpaths, output=False, isolated=isolated, seed=seed, adaptive=adaptive, best=best)
+    paths = paths1 + paths2 + paths3 + paths4
+    path_info_groups = []
+    connected_anodes = {}
+    if paths:
+        path_info_groups, connected_anodes = group_paths(paths, anchornodes)
+    filtered_groups, discarded_groups = filter_path_groups(path_info_groups)
+
+    # Groups are encoded before finalize_paths(), which sorts them
+    encode_pathinfo = lambda pathinfo: pathinfo[:6] + (encode_path(pathinfo[6]),)
+    encoded_groups = []
+    group_idx = {}
+    pathinfo_idx = {}
+    for i in xrange(len(path_info_groups)):
+        pgroup = path_info_groups[i]
+        group_idx[id(pgroup)] = i
+        for j in xrange(len(pgroup)):
+            pathinfo_idx[id(pgroup[j])] = (i, j)
+        encoded_groups.append([encode_pathinfo(pathinfo) for pathinfo in pgroup])
+    filtered_idx = [group_idx[id(pgroup)] for pgroup in filtered_groups]
+    discarded_idx = [group_idx[id(pgroup)] for pgroup in discarded_groups]
+
+    final_paths = finalize_paths(filtered_groups, paths)
+    final_idx = [pathinfo_idx[id(pathinfo)] for pathinfo in final_paths]
+
+    return ([encode_path(path) for path in paths1], [encode_path(path) for path in paths2], [encode_path(path) for path in paths3],
+            [encode_path(path) for path in paths4[:numbest]], [encode_path(path) for path in paths4[numbest:]], encoded_groups, connected_anodes.keys(), filtered_idx, discarded_idx, final_idx)
+
+
+# Finds connected components of the graph and scaffolds each component separately,
+# in a pool of numthreads processes
+# Results are merged so that they are the same as when processing the whole graph at once
+# (except for Monte Carlo paths, which are random)
+# If seed is given, each component uses its own seed derived from it, so that Monte Carlo paths are reproducible
+def scaffold_components(anchornodes, readnodes, crovledges, rrovledges, numthreads, output=True, isolated=False, seed=None, adaptive=False, best=False):
+    global _components
+
+    components = find_components(anchornodes, readnodes)
+    if output:
+        sys.stdout.write('\nPYHERA: Scaffolding %d connected components in %d processes ...' % (len(components), numthreads))
+
+    # Each component generates a number of Monte Carlo paths proportional to its number of anchor nodes
+    _components = []
+    for (compidx, (comp_anodes, comp_rnodes)) in enumerate(components):
+        minMCpaths = int(math.ceil(float(MinMCPaths) * len(comp_anodes) / len(anchornodes)))
+        comp_seed = derive_seed(seed, compidx) if seed is not None else None
+        _components.append((comp_anodes, comp_rnodes, minMCpaths, isolated, comp_seed, adaptive, best))
+    edges = _edge_table
+
+    if numthreads > 1 and len(_components) > 1:
+        pool = multiprocessing.Pool(numthreads)
+        results = pool.map(scaffold_component, xrange(len(_components)))
+        pool.close()
+        pool.join()
+    else:
+        results = [scaffold_component(compidx) for compidx in xrange(len(_components))]
+
+    # Merging results
+    paths1 = []
+    paths2 = []
+    paths3 = []
+    paths4ovl = []
+    paths4ext = []
+    path_info_groups = []
+    connected_anodes = {}
+    filtered = []
+    discarded = []
+    for (enc_paths1, enc_paths2, enc_paths3, enc_paths4ovl, enc_paths4ext, encoded_groups, connected_names, filtered_idx, discarded_idx, final_idx) in results:
+        paths1 += [decode_path(code, edges) for code in enc_paths1]
+        paths2 += [decode_path(code, edges) for code in enc_paths2]
+        paths3 += [decode_path(code, edges) for code in enc_paths3]
+        paths4ovl += [decode_path(code, edges) for code in enc_paths4ovl]
+        paths4ext += [decode_path(code, edges) for code in enc_paths4ext]
+        groups = [[pathinfo[:6] + (decode_path(pathinfo[6], edges),) for pathinfo in egroup] for egroup in encoded_groups]
+        path_info_groups += groups
+        for aname in connected_names:
+            connected_anodes[aname] = anchornodes[aname]
+        for k in xrange(len(filtered_idx)):
+            (i, j) = final_idx[k]
+            filtered.append((groups[filtered_idx[k]], groups[i][j]))
+        discarded += [groups[i] for i in discarded_idx]
+
+    # Restoring the order in which paths and groups are generated for the whole graph
+    # Deterministic approaches process anchor nodes in the order of their names, each anchor node belongs
+    # to a single component, so a stable sort of the paths of each search restores their order
+    # The fourth approach searches first using OVERLAP and then using EXTENSION score
+    paths1.sort(key=lambda path: path[0].startNode.name)
+    paths2.sort(key=lambda path: path[0].startNode.name)
+    paths4ovl.sort(key=lambda path: path[0].startNode.name)
+    paths4ext.sort(key=lambda path: path[0].startNode.name)
+    paths4 = paths4ovl + paths4ext
+    path_info_groups.sort(key=lambda pgroup: (pgroup[0][0], pgroup[0][1]))
+    filtered.sort(key=lambda (pgroup, pathinfo): (-group_size(pgroup), pgroup[0][0], pgroup[0][1]))
+    filtered_groups = [pgroup for (pgroup, pathinfo) in filtered]
+    final_paths = [pathinfo for (pgroup, pathinfo) in filtered]
+    discarded_left = [pgroup for pgroup in discarded if pgroup[0][4] == directionLEFT]
+    discarded_right = [pgroup for pgroup in discarded if pgroup[0][4] != directionLEFT]
+    discarded_left.sort(key=lambda pgroup: (pgroup[0][0], pgroup[0][1]))
+    discarded_right.sort(key=lambda pgroup: (-group_size(pgroup), pgroup[0][0], pgroup[0][1]))
+    discarded_groups = discarded_left + discarded_right
+
+    if output:
+        sys.stdout.write('\nPYHERA: Approach 1 returned %d paths!\n' % len(paths1))
+        sys.stdout.write('\nPYHERA: Approach 2 returned %d paths!\n' % len(paths2))
+        sys.stdout.write('\nPYHERA: Approach 3 returned %d paths!\n' % len(paths3))
+        if best:
+            sys.stdout.write('\nPYHERA: Approach 4 returned %d paths!\n' % len(paths4))
+
+    return paths1, paths2, paths3, paths4, path_info_groups, connected_anodes, filtered_groups, discarded_groups, final_paths
+
 
 def start_pyhera(contigs_file, reads_file, cr_overlaps_file, rr_overlaps_file, paramdict, output=True):
 
@@ -1578,6 +3156,7 @@ def start_pyhera(contigs_file, reads_file, cr_overlaps_file, rr_overlaps_file, p
     if output:
         sys.stdout.write('\n[%s]PYHERA: Loading reads ...' % datetime.now().time().isoformat())
     readnodes = load_readnodes(reads_file, output = False)
+    index_nodes(anchornodes, readnodes)
 
     # 3. processing overlaps between contigs and reads
     # NOTE: for the overlaps file, we can not be sure whether query or target
@@ -1614,49 +3193,61 @@ def start_pyhera(contigs_file, reads_file, cr_overlaps_file, rr_overlaps_file, p
     if output:
         sys.stdout.write('\nPYHERA cleanup removed %d edges/overlaps:' % edgesRemoved)
         sys.stdout.write('\nPYHERA after cleanup: ANODES: %d, RNODES: %d, CROVL: %d, RROVL: %d' % (len(anchornodes), len(readnodes), len(crovledges), len(rrovledges)))
+
+    # Optionally removing transitive read/read edges, to reduce the number of edges considered
+    # when searching for paths
+    if '--transitive-reduction' in paramdict:
+        if output:
+            sys.stdout.write('\n[%s]PYHERA: Transitive reduction of the graph ...' % datetime.now().time().isoformat())
+        transitive_reduction(readnodes, rrovledges, TRFuzz, output)
+        if output:
+            sys.stdout.write('\nPYHERA after transitive reduction: ANODES: %d, RNODES: %d, CROVL: %d, RROVL: %d' % (len(anchornodes), len(readnodes), len(crovledges), len(rrovledges)))
     
+    if ReachabilityPruning:
+        label_anchor_reachability(anchornodes, readnodes)
+    reset_adjacency()
+    create_edge_table(anchornodes, readnodes)
+
     ### Calculating paths through the graph
     if output:
         sys.stdout.write('\n[%s]PYHERA: Calculating paths ...' % datetime.now().time().isoformat())
-    # 1. Approach
-    # For every anchor node consider all connecting read nodes
-    # For further extension consider only the read with the highest OVERLAP score
-    paths1 = getPaths_maxovl(anchornodes, readnodes, crovledges, rrovledges)
-    if output:
-        sys.stdout.write('\nPYHERA: Approach 1 returned %d paths!\n' % len(paths1))
-
-
-    # 2. Approach
-    # For every anchor node consider all connecting read nodes
-    # For further extension consider only the read with the highest EXTENSION score
-    paths2 = getPaths_maxext(anchornodes, readnodes, crovledges, rrovledges)
-    if output:
-        sys.stdout.write('\nPYHERA: Approach 2 returned %d paths!\n' % len(paths2))
-
-    # 3. Approach
-    # Monte Carlo method - randomly select reads for each extension
-    # probability of selecting a read is proportional to extension score
-    # This approach must generate more paths then first two approaches combined
-    numMCpaths = 2*(len(paths1) + len(paths2) + 1)
-    if numMCpaths < MinMCPaths:
-        numMCpaths = MinMCPaths
-    paths3 = getPaths_MC(anchornodes, readnodes, crovledges, rrovledges, numMCpaths)
-    if output:
-        sys.stdout.write('\nPYHERA: Approach 3 returned %d paths!\n' % len(paths3))
+    split_components = '--split-components' in paramdict
+    parallel_paths = '--parallel-paths' in paramdict
+    seed = None
+    if '--seed' in paramdict:
+        seed = int(paramdict['--seed'][0])
+    adaptive_mc = '--adaptive-mc' in paramdict
+    best_paths = '--best-paths' in paramdict
+    aggregator = None
+    if '--stream-paths' in paramdict:
+        if split_components:
+            sys.stdout.write('\nPYHERA WARNING: --stream-paths is not used with --split-components!')
+        else:
+            aggregator = PathAggregator('--check-paths' in paramdict)
+    if split_components:
+        # Each connected component is processed separately, up to grouping and filtering the paths
+        (paths1, paths2, paths3, paths4, path_info_groups, connected_anodes, filtered_groups, discarded_groups, final_paths) = \
+            scaffold_components(anchornodes, readnodes, crovledges, rrovledges, numthreads, output, parallel_paths, seed, adaptive_mc, best_paths)
+    else:
+        paths1, paths2, paths3, paths4, numbest = collect_paths(anchornodes, readnodes, crovledges, rrovledges, MinMCPaths, output, parallel_paths, numthreads, seed, adaptive_mc, best_paths, aggregator)
 
-    paths = paths1 + paths2 + paths3
+    paths = paths1 + paths2 + paths3 + paths4
     # Sanity check: checking eash path for consistency
     sys.stdout.write('\nPYHERA: Checking paths for consistency: ')
     inconsitent_paths = 0
     for path in paths:
         if not check_path_consistency(path):
             inconsitent_paths += 1
+    if aggregator is not None:
+        inconsitent_paths += aggregator.numinconsistent          # Paths have been checked when added
     if inconsitent_paths > 0:
         sys.stdout.write('%d paths are inconsistent!' % inconsitent_paths)
     else:
         sys.stdout.write('All paths are consistent!')
 
-    if '--print-graph' in paramdict:
+    if '--print-graph' in paramdict and aggregator is not None:
+        sys.stdout.write('\nPYHERA WARNING: --print-graph is not used with --stream-paths, paths are not kept!')
+    elif '--print-graph' in paramdict:
         sys.stdout.write('\nPYHERA: Printing generated paths to %s' % 'graph.txt')
         fgraph = open('graph.txt', 'w')
         # Printing summary information
@@ -1685,6 +3276,8 @@ def start_pyhera(contigs_file, reads_file, cr_overlaps_file, rr_overlaps_file, p
             invalid = check_path(path)
             if invalid == True:
                 invalid_paths = True
+        if aggregator is not None and aggregator.numinvalid > 0:
+            invalid_paths = True
         if invalid_paths == True:
             sys.stdout.write("\nPYHERA: Invalid paths found!")
         else :
@@ -1695,10 +3288,15 @@ def start_pyhera(contigs_file, reads_file, cr_overlaps_file, rr_overlaps_file, p
         sys.stdout.write('\n[%s]PYHERA: Processing paths ...' % datetime.now().time().isoformat())
         sys.stdout.write('\nPYHERA: Grouping paths ...\n')
 
-    if len(paths) == 0:
+    if len(paths) == 0 and (aggregator is None or len(aggregator) == 0):
         sys.stdout.write('\nPYHERA WARNING: No paths generated! Unable to proceed. Quiting ...\n')
         return
-    path_info_groups, connected_anodes = group_paths(paths, anchornodes)
+    if aggregator is not None:
+        # Paths have already been grouped, filtered and finalized as they were generated
+        (group_summaries, filtered_summaries, discarded_summaries, final_paths) = aggregator.finalize()
+        connected_anodes = dict((aname, anchornodes[aname]) for aname in aggregator.connected)
+    elif not split_components:
+        path_info_groups, connected_anodes = group_paths(paths, anchornodes)
 
     # Determine initial connected nodes
     for aname, anode in anchornodes.iteritems():
@@ -1714,36 +3312,41 @@ def start_pyhera(contigs_file, reads_file, cr_overlaps_file, rr_overlaps_file, p
         #     sys.stdout.write(' %s,' % aname)
 
 
+    if aggregator is None:
+        group_summaries = [path_group_summary(pgroup) for pgroup in path_info_groups]
+
     if output:
         sys.stdout.write('\n\nPYHERA: Path group info: SNODE, ENODE, DIRECTION, NUMPATHS')
-        for pinfo_group in path_info_groups:
-            (sname, ename, length, numNodes, direction, SIavg, path) = pinfo_group[0]
+        for (sname, ename, direction, numpaths) in group_summaries:
             sdirection = 'LEFT' if direction == directionLEFT else 'RIGHT'
-            sys.stdout.write('\nPYHERA: %s %s %s %d' % (sname, ename, sdirection, len(pinfo_group)))
+            sys.stdout.write('\nPYHERA: %s %s %s %d' % (sname, ename, sdirection, numpaths))
 
     if output:
         sys.stdout.write('\n\nPYHERA: Filtering path groups ...\n')
 
-    filtered_groups, discarded_groups = filter_path_groups(path_info_groups)
+    if aggregator is None:
+        if not split_components:
+            filtered_groups, discarded_groups = filter_path_groups(path_info_groups)
+        filtered_summaries = [path_group_summary(pgroup) for pgroup in filtered_groups]
+        discarded_summaries = [path_group_summary(pgroup) for pgroup in discarded_groups]
 
     if output:
         sys.stdout.write('\nPYHERA: Discarded groups: SNODE, ENODE, DIRECTION, NUMPATHS')
-        for pinfo_group in discarded_groups:
-            (sname, ename, length, numNodes, direction, SIavg, path) = pinfo_group[0]
+        for (sname, ename, direction, numpaths) in discarded_summaries:
             sdirection = 'LEFT' if direction == directionLEFT else 'RIGHT'
-            sys.stdout.write('\nPYHERA: %s %s %s %d' % (sname, ename, sdirection, len(pinfo_group)))
+            sys.stdout.write('\nPYHERA: %s %s %s %d' % (sname, ename, sdirection, numpaths))
 
         sys.stdout.write('\n\nPYHERA: Remaining groups: SNODE, ENODE, DIRECTION, NUMPATHS')
-        for pinfo_group in filtered_groups:
-            (sname, ename, length, numNodes, direction, SIavg, path) = pinfo_group[0]
+        for (sname, ename, direction, numpaths) in filtered_summaries:
             sdirection = 'LEFT' if direction == directionLEFT else 'RIGHT'
-            sys.stdout.write('\nPYHERA: %s %s %s %d' % (sname, ename, sdirection, len(pinfo_group)))
+            sys.stdout.write('\nPYHERA: %s %s %s %d' % (sname, ename, sdirection, numpaths))
 
 
     if output:
         sys.stdout.write('\n\nPYHERA: Final path filtering ...\n')
 
-    final_paths = finalize_paths(filtered_groups, paths)
+    if aggregator is None and not split_components:
+        final_paths = finalize_paths(filtered_groups, paths)
 
     # pathinfo: (sname, ename, length, numNodes, direction, SIavg, path)
     longpaths = 0
@@ -1759,16 +3362,24 @@ def start_pyhera(contigs_file, reads_file, cr_overlaps_file, rr_overlaps_file, p
         sys.stdout.write('\nWARNING: Final paths contain %d paths longer than %d nodes!' % (longpaths, SoftNodeLimit))
         sys.stdout.write('\nYou should consider altering global PyHera parameters!')
 
+    layout_only = '--layout-only' in paramdict
     if output:
-        sys.stdout.write('\n\n[%s]PYHERA: Generating FASTA ...' % datetime.now().time().isoformat())
-    out_filename = 'scaffolds.fasta'
+        sys.stdout.write('\n\n[%s]PYHERA: Generating %s ...' % (datetime.now().time().isoformat(), 'layout' if layout_only else 'FASTA'))
+    out_filename = 'scaffolds.agp' if layout_only else 'scaffolds.fasta'
     if '-o' in paramdict:
         out_filename = paramdict['-o'][0]
     elif '--output' in paramdict:
         out_filename = paramdict['--output'][0]
-    headers, seqs = generate_fasta(final_paths, anchornodes, readnodes, filename = out_filename)
+    if layout_only:
+        # Only the layout of scaffolds is written, FASTA can be generated from it later (see layout2fasta.py)
+        headers, segments_list = scaffold_layout(final_paths, anchornodes)
+        write_layout(headers, segments_list, out_filename)
+    else:
+        headers, seqs = generate_fasta(final_paths, anchornodes, readnodes, filename = out_filename, numthreads = numthreads)
 
-    if output:
+    if output and layout_only:
+        sys.stdout.write('\nPYHERA: Scaffold layouts generated: %d\n' % len(headers))
+    elif output:
         sys.stdout.write('\nPYHERA: FASTA sequences generated: %d\n' % len(headers))
         # for header in headers:
         #     sys.stdout.write('\n%s' % header)